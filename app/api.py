@@ -0,0 +1,202 @@
+# app/api.py
+# Read-only HTTP API для разбора журнала: поиск сообщений с постраничной выдачей, потоковая выгрузка
+# и текущий состав чатов.
+import os
+import io
+import csv
+import json
+import hmac
+import base64
+import logging
+from datetime import datetime, timezone
+from flask import Blueprint, request, abort, jsonify, Response
+from .database import queries
+
+log = logging.getLogger(__name__)
+
+READ_API_TOKEN = os.getenv("READ_API_TOKEN")  # Bearer-токен; без него API отключён
+# Bearer-токен для /metrics и /stats (там chat_id всех отслеживаемых чатов); по умолчанию — READ_API_TOKEN.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") or READ_API_TOKEN
+API_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", 50))
+API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", 500))
+API_EXPORT_CHUNK_ROWS = int(os.getenv("API_EXPORT_CHUNK_ROWS", 1000))
+
+EXPORT_FIELDS = ("chat_id", "message_id", "user_id", "created_at", "text")
+BIGINT_MIN, BIGINT_MAX = -2 ** 63, 2 ** 63 - 1  # диапазон колонок chat_id/user_id/message_id
+
+api = Blueprint("api", __name__, url_prefix="/api")
+
+
+def require_token(expected):
+    """Пропускает запрос только с заголовком 'Authorization: Bearer <expected>'; без токена эндпоинт отключён (404)."""
+    if not expected:
+        abort(404)
+    header = request.headers.get("Authorization", "")
+    scheme, _, token = header.partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), expected.encode()):
+        abort(401)
+
+
+@api.before_request
+def check_token():
+    require_token(READ_API_TOKEN)
+
+
+def _bad_request(message):
+    abort(Response(json.dumps({"error": message}, ensure_ascii=False), status=400, mimetype="application/json"))
+
+
+def _int_arg(name):
+    value = request.args.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        parsed = int(value)
+    except ValueError:
+        _bad_request(f"{name}: ожидается целое число")
+    return _bigint(name, parsed)
+
+
+def _bigint(name, value):
+    """Число, которое не влезет в BIGINT, — ошибка запроса, а не DataError в БД (ответ был бы 503)."""
+    if not BIGINT_MIN <= value <= BIGINT_MAX:
+        _bad_request(f"{name}: число вне допустимого диапазона")
+    return value
+
+
+def _time_arg(name):
+    """Unix-время в секундах или ISO 8601; время без часового пояса считается UTC."""
+    value = request.args.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        return datetime.fromtimestamp(float(value), tz=timezone.utc)
+    except (OverflowError, OSError):
+        _bad_request(f"{name}: время вне допустимого диапазона")
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        _bad_request(f"{name}: ожидается unix-время или дата ISO 8601")
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _filters():
+    return {
+        "chat_id": _int_arg("chat_id"),
+        "user_id": _int_arg("user_id"),
+        "since": _time_arg("since"),
+        "until": _time_arg("until"),
+        "text": request.args.get("q") or None,
+    }
+
+
+def _encode_cursor(row):
+    chat_id, message_id, _, created_at, _ = row
+    raw = f"{created_at.isoformat()}|{chat_id}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(value):
+    try:
+        created_at, chat_id, message_id = base64.urlsafe_b64decode(value.encode()).decode().split("|")
+        created_at, chat_id, message_id = datetime.fromisoformat(created_at), int(chat_id), int(message_id)
+    except ValueError:
+        _bad_request("cursor: неверное значение")
+    return created_at, _bigint("cursor", chat_id), _bigint("cursor", message_id)
+
+
+def _row_dict(row):
+    item = dict(zip(EXPORT_FIELDS, row))
+    item["created_at"] = item["created_at"].isoformat()
+    return item
+
+
+@api.route('/messages', methods=['GET'])
+def search():
+    """
+    Поиск по журналу сообщений: chat_id, user_id, since, until, q (полнотекстовый запрос), limit.
+    Выдача от новых к старым; следующая страница — тот же запрос с cursor=next_cursor.
+    """
+    filters = _filters()
+    limit = min(max(_int_arg("limit") or API_PAGE_SIZE, 1), API_MAX_PAGE_SIZE)
+    cursor = request.args.get("cursor")
+    after = _decode_cursor(cursor) if cursor else None
+
+    rows = queries.search_messages(filters, limit, after=after)
+    if rows is None:
+        return jsonify({"error": "database unavailable"}), 503
+    next_cursor = _encode_cursor(rows[-1]) if len(rows) == limit else None
+    return jsonify({"items": [_row_dict(row) for row in rows], "next_cursor": next_cursor}), 200
+
+
+def _ndjson_chunk(rows):
+    return "".join(json.dumps(_row_dict(row), ensure_ascii=False) + "\n" for row in rows)
+
+
+def _csv_chunk(rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    for row in rows:
+        writer.writerow(_row_dict(row).values())
+    return out.getvalue()
+
+
+@api.route('/messages/export', methods=['GET'])
+def export():
+    """
+    Потоковая выгрузка всех сообщений по тем же фильтрам, в хронологическом порядке.
+    format=ndjson (по умолчанию) или csv. Ответ отдаётся частями, память не зависит от объёма выгрузки.
+    """
+    filters = _filters()
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in ("ndjson", "csv"):
+        _bad_request("format: ndjson или csv")
+
+    chunks = queries.export_messages(filters, API_EXPORT_CHUNK_ROWS)
+    if chunks is None:
+        return jsonify({"error": "database unavailable"}), 503
+    # Первую пачку читаем сразу: ошибка запроса должна стать кодом ответа, а не оборванным потоком.
+    try:
+        first = next(chunks, [])
+    except Exception as e:
+        log.error(f"Ошибка выгрузки сообщений: {e}", exc_info=True)
+        return jsonify({"error": "export failed"}), 500
+
+    format_chunk = _csv_chunk if export_format == "csv" else _ndjson_chunk
+
+    def generate():
+        try:
+            if export_format == "csv":
+                yield ",".join(EXPORT_FIELDS) + "\n"
+            if first:
+                yield format_chunk(first)
+            for rows in chunks:
+                yield format_chunk(rows)
+        finally:
+            chunks.close()
+
+    mimetype = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return Response(generate(), mimetype=mimetype)
+
+
+@api.route('/chats/<int(signed=True):chat_id>/members', methods=['GET'])
+def chat_members(chat_id):
+    """Текущие участники чата по последним событиям chat_member."""
+    _bigint("chat_id", chat_id)
+    rows = queries.get_chat_members(chat_id)
+    if rows is None:
+        return jsonify({"error": "database unavailable"}), 503
+    fields = ("user_id", "username", "first_name", "status")
+    return jsonify({"items": [dict(zip(fields, row)) for row in rows]}), 200
+
+
+@api.route('/users/<int:user_id>/chats', methods=['GET'])
+def user_chats(user_id):
+    """Чаты, по которым есть сведения о пользователе, и состоит ли он в них сейчас."""
+    _bigint("user_id", user_id)
+    memberships = queries.get_user_memberships(user_id)
+    if memberships is None:
+        return jsonify({"error": "database unavailable"}), 503
+    return jsonify({"items": [{"chat_id": chat_id, "is_member": is_member} for chat_id, is_member in sorted(memberships.items())]}), 200
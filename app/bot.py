@@ -1,20 +1,37 @@
-# app/bot.py (Полная версия с максимальным логированием)
+# app/bot.py
 import os
+import json
+import atexit
+import random
 import logging
-from flask import Flask, request, abort
+import threading
+from collections import Counter
+from flask import Flask, request, abort, jsonify, Response
+from werkzeug.exceptions import HTTPException
 from telebot import TeleBot, types
-from threading import Thread # <-- Добавьте этот импорт
-from .services import sync_editors_list # <-- Добавьте этот импорт
+from . import metrics
+from .services import schedule_editor_sync, schedule_message_log_maintenance
+from . import lifecycle
+from .database import queries
+from .api import api, require_token, METRICS_TOKEN
+from .dispatcher import UpdateDispatcher, update_type_of
+from .dedup import UpdateDeduplicator, UPDATE_DEDUP_LRU_SIZE, UPDATE_HWM_PERSIST_INTERVAL, UPDATE_DEDUP_FLOOR_WINDOW
 
 # --- 1. Настройка логирования и чтение переменных окружения ---
 logging.basicConfig(
-    level=logging.DEBUG, # Устанавливаем уровень DEBUG, чтобы видеть все сообщения
+    level=os.getenv("LOG_LEVEL", "INFO").upper(), # DEBUG включает подробные логи каждого этапа
     format='%(asctime)s - %(name)s - %(levelname)s - [BOT-WEBHOOK] %(message)s'
 )
 log = logging.getLogger(__name__)
 
 TOKEN = os.getenv("HJRSCANNER_TELEGRAM_TOKEN")
 SECRET = os.getenv("WEBHOOK_SECRET") # Секрет для проверки заголовка X-Telegram-Bot-Api-Secret-Token
+# Режим "сначала ответить": апдейт кладётся в очередь, Telegram сразу получает 200.
+WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "0") == "1"
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 4))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+# Доля запросов, для которых в лог пишутся заголовки и тело (0 — выключено, 1 — каждый запрос).
+WEBHOOK_TRACE_SAMPLE_RATE = float(os.getenv("WEBHOOK_TRACE_SAMPLE_RATE", 0))
 
 if not TOKEN:
     log.critical("КРИТИЧЕСКАЯ ОШИБКА: HJRSCANNER_TELEGRAM_TOKEN не задан.")
@@ -25,74 +42,206 @@ if not SECRET:
 # --- 2. Инициализация ---
 bot = TeleBot(TOKEN, threaded=False)
 app = Flask(__name__)
+app.register_blueprint(api)
 
-def run_on_startup():
-    """Задачи, которые выполняются один раз при запуске бота."""
-    import time
-    time.sleep(3) # Небольшая задержка, чтобы дать другим сервисам запуститься
-    log.info("Запуск первоначальной синхронизации списка редакторов...")
-    try:
-        sync_editors_list(bot)
-    except Exception as e:
-        log.error(f"Первоначальная синхронизация редакторов провалилась: {e}", exc_info=True)
+def process_raw_update(update_json):
+    """Разбирает сырой апдейт и прогоняет его через зарегистрированные обработчики."""
+    with metrics.WEBHOOK_STAGE_SECONDS.time("de_json"):
+        update = types.Update.de_json(update_json)
+    with metrics.WEBHOOK_STAGE_SECONDS.time("dispatch"):
+        bot.process_new_updates([update])
 
-startup_thread = Thread(target=run_on_startup)
-startup_thread.start()
-# --- КОНЕЦ ИЗМЕНЕНИЙ ---
+dispatcher = UpdateDispatcher(process_raw_update, workers=WEBHOOK_WORKERS, capacity=WEBHOOK_QUEUE_SIZE)
 
-# --- 3. Регистрация обработчиков --- (теперь пункт 3)
-from .handlers import register_all_handlers
-register_all_handlers(bot)
-log.info("Все обработчики успешно зарегистрированы.")
+UPDATE_HWM_KEY = "update_id_high_water_mark"
+# Отметка старше недели не используется: после недели тишины Telegram начинает нумерацию заново.
+deduplicator = UpdateDeduplicator(
+    load_hwm=lambda: queries.get_bot_state(UPDATE_HWM_KEY, max_age_days=7),
+    save_hwm=lambda update_id: queries.set_bot_state(UPDATE_HWM_KEY, update_id, monotonic=True),
+    lru_size=UPDATE_DEDUP_LRU_SIZE,
+    persist_interval=UPDATE_HWM_PERSIST_INTERVAL,
+    floor_window=UPDATE_DEDUP_FLOOR_WINDOW,
+)
+
+def shutdown():
+    """Дорабатывает принятые апдейты, дописывает буферы в БД и отпускает роль ведущего процесса."""
+    lifecycle.stop()
+    dispatcher.stop()
+    deduplicator.stop()
+    queries.shutdown()
+
+atexit.register(shutdown)
+
+# Периодические задачи только регистрируются; выполняет их ведущий процесс (app/lifecycle.py).
+schedule_editor_sync(bot)
+schedule_message_log_maintenance()
+# Туннель, схема БД и фоновые потоки поднимаются при первом запросе, уже в воркере.
+app.before_request(lifecycle.ensure_started)
 
 # --- 3. Регистрация обработчиков ---
 from .handlers import register_all_handlers
+from .handlers.security import ALLOWED_CHAT_IDS
 register_all_handlers(bot)
 log.info("Все обработчики успешно зарегистрированы.")
 
-# --- 4. Маршрут для вебхука (ИЗМЕНЕН ДЛЯ ДЕТАЛЬНОГО ЛОГИРОВАНИЯ) ---
+# --- Быстрый фильтр апдейтов ---
+# Типы апдейтов, для которых есть хотя бы один обработчик (атрибуты TeleBot вида '<тип>_handlers').
+HANDLED_UPDATE_TYPES = frozenset(
+    update_type for update_type in (
+        'message', 'edited_message', 'channel_post', 'edited_channel_post',
+        'chat_member', 'my_chat_member', 'chat_join_request', 'callback_query',
+    ) if getattr(bot, f"{update_type}_handlers", None)
+)
+_dropped_updates = Counter()  # (причина, тип апдейта) -> количество
+_dropped_lock = threading.Lock()
+
+def prefilter_update(update_json):
+    """
+    Решает по сырому словарю, нужен ли апдейт, не создавая объектов telebot.
+    Возвращает причину отбраковки или None, если апдейт надо обработать.
+    """
+    update_type = update_type_of(update_json)
+    if update_type not in HANDLED_UPDATE_TYPES:
+        metrics.UPDATES_TOTAL.inc(update_type, "other")
+        reason = 'unhandled_type'
+    else:
+        chat = update_json[update_type].get('chat')
+        chat_id = chat.get('id') if chat else None
+        if chat_id in ALLOWED_CHAT_IDS:
+            metrics.UPDATES_TOTAL.inc(update_type, chat_id)
+            return None
+        # Метка chat_id только для отслеживаемых чатов, чтобы число рядов метрики было ограничено.
+        metrics.UPDATES_TOTAL.inc(update_type, "other")
+        if not chat or chat.get('type') == 'private':
+            return None
+        reason = 'chat_not_allowed'
+    with _dropped_lock:
+        _dropped_updates[(reason, update_type)] += 1
+    return reason
+
+def get_dropped_stats():
+    with _dropped_lock:
+        return [{"reason": reason, "update_type": update_type, "count": count}
+                for (reason, update_type), count in _dropped_updates.items()]
+
+def _collect_metrics():
+    for item in get_dropped_stats():
+        yield ("hjr_updates_dropped_total", "Апдейты, отброшенные быстрым фильтром.", "counter",
+               {"reason": item["reason"], "update_type": item["update_type"]}, item["count"])
+    stats = dispatcher.stats()
+    yield "hjr_update_queue_depth", "Апдейты в очереди воркеров.", "gauge", {}, stats["queued"]
+    yield "hjr_update_queue_rejected_total", "Апдейты, отклонённые с 503 из-за переполнения очереди.", "counter", {}, stats["rejected"]
+    yield "hjr_update_queue_failed_total", "Апдейты, обработка которых в воркере упала.", "counter", {}, stats["failed"]
+    dedup = deduplicator.stats()
+    yield "hjr_updates_duplicate_total", "Повторно доставленные апдейты, пропущенные без обработки.", "counter", {"source": "recent"}, dedup["skipped_recent"]
+    yield "hjr_updates_duplicate_total", "Повторно доставленные апдейты, пропущенные без обработки.", "counter", {"source": "high_water_mark"}, dedup["skipped_below_hwm"]
+
+metrics.register_collector(_collect_metrics)
+
+def _trace_request(request_body):
+    """Выборочная трассировка запроса; секретный заголовок не попадает в лог."""
+    headers = {
+        header: ('***' if header.lower() == 'x-telegram-bot-api-secret-token' else value)
+        for header, value in request.headers.items()
+    }
+    log.info(f"[TRACE] {request.method} {request.url} заголовки={headers} тело={request_body}")
+
+def _accept(update_id):
+    if update_id is not None:
+        deduplicator.accept(update_id)
+
+def _forget(update_id):
+    if update_id is not None:
+        deduplicator.forget(update_id)
+
+# --- 4. Маршрут для вебхука ---
 @app.route('/telegram/hjr-scanner', methods=['POST'])
 def webhook():
-    log.info("--- 1. ВЕБХУК ПОЛУЧИЛ ЗАПРОС ---")
+    log.debug("--- 1. ВЕБХУК ПОЛУЧИЛ ЗАПРОС ---")
+    update_id = None  # задан, пока апдейт отмечен в deduplicator, но ещё не принят
     try:
-        # --- ДЕТАЛЬНЫЙ ЛОГ ЗАПРОСА ---
-        log.debug(f"Метод запроса: {request.method}")
-        log.debug(f"URL запроса: {request.url}")
-        log.debug("--- Заголовки запроса ---")
-        for header, value in request.headers.items():
-            log.debug(f"{header}: {value}")
-        log.debug("--- Тело запроса (raw) ---")
         request_body = request.get_data(as_text=True)
-        log.debug(request_body)
-        log.debug("---------------------------")
-        # --- КОНЕЦ ДЕТАЛЬНОГО ЛОГА ---
+        if WEBHOOK_TRACE_SAMPLE_RATE and random.random() < WEBHOOK_TRACE_SAMPLE_RATE:
+            _trace_request(request_body)
 
         if request.headers.get('content-type') == 'application/json':
             if SECRET:
-                log.info("--- 2. ПРОВЕРЯЮ СЕКРЕТНЫЙ ТОКЕН ---")
-                header_secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
-                if header_secret != SECRET:
-                    log.error(f"ОШИБКА: Неверный Secret Token. Ожидался: '{SECRET}', получен: '{header_secret}'.")
-                    abort(403)
-                log.info("Секретный токен верный.")
+                with metrics.WEBHOOK_STAGE_SECONDS.time("secret_check"):
+                    header_secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
+                    if header_secret != SECRET:
+                        log.error("ОШИБКА: Неверный Secret Token в запросе к вебхуку.")
+                        abort(403)
             else:
-                log.warning("Проверка секретного токена пропущена, т.к. переменная WEBHOOK_SECRET не установлена.")
+                log.debug("Проверка секретного токена пропущена, т.к. переменная WEBHOOK_SECRET не установлена.")
 
-            log.info("--- 3. ПЕРЕДАЮ ДАННЫЕ В TELEBOT ---")
-            update = types.Update.de_json(request_body)
-            bot.process_new_updates([update])
-            log.info("--- 4. ОБРАБОТКА TELEBOT ЗАВЕРШЕНА ---")
+            with metrics.WEBHOOK_STAGE_SECONDS.time("parse"):
+                update_json = json.loads(request_body)
+            if update_json.get('update_id') is not None:
+                if deduplicator.is_duplicate(update_json['update_id']):
+                    log.debug("Апдейт %s уже был получен, повтор пропущен.", update_json['update_id'])
+                    return '', 200
+                update_id = update_json['update_id']
+
+            with metrics.WEBHOOK_STAGE_SECONDS.time("prefilter"):
+                drop_reason = prefilter_update(update_json)
+            if drop_reason:
+                log.debug("Апдейт %s отброшен быстрым фильтром: %s.", update_json.get('update_id'), drop_reason)
+                _accept(update_id)
+                return '', 200
+
+            if WEBHOOK_ASYNC:
+                with metrics.WEBHOOK_STAGE_SECONDS.time("enqueue"):
+                    accepted = dispatcher.submit(update_json)
+                if not accepted:
+                    log.warning(f"Очередь апдейтов переполнена, апдейт {update_json.get('update_id')} отклонён (503).")
+                    _forget(update_id)
+                    return "Busy", 503
+                _accept(update_id)
+                log.debug("--- 2. АПДЕЙТ ПОСТАВЛЕН В ОЧЕРЕДЬ ---")
+                return '', 200
+
+            process_raw_update(update_json)
+            _accept(update_id)
+            log.debug("--- 2. ОБРАБОТКА TELEBOT ЗАВЕРШЕНА ---")
             return '', 200
         else:
             log.error(f"Отклонён запрос: неверный Content-Type: {request.headers.get('content-type')}")
             abort(403)
+    except HTTPException:
+        raise
     except Exception as e:
         log.error(f"КРИТИЧЕСКАЯ ОШИБКА внутри обработчика webhook: {e}", exc_info=True)
-        log.info("--- ОБРАБОТКА ВЕБХУКА ЗАВЕРШЕНА С ОШИБКОЙ ---")
+        # Telegram пришлёт апдейт снова — повтор должен дойти до обработчиков.
+        _forget(update_id)
         return "Error", 500
 
 @app.route('/health', methods=['GET'])
 def health_check():
     return "OK", 200
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Готовность принимать апдейты: процесс запущен и схема БД на месте. /health же только подтверждает, что процесс жив."""
+    ready, details = lifecycle.readiness()
+    return jsonify(details), 200 if ready else 503
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Внутренняя статистика процесса (пул соединений с БД и т.п.). Требует METRICS_TOKEN."""
+    require_token(METRICS_TOKEN)
+    return jsonify({
+        "db_pool": queries.get_pool_stats(),
+        "write_buffers": queries.get_buffer_stats(),
+        **queries.get_spool_stats(),
+        "dispatcher": dispatcher.stats(),
+        "deduplication": deduplicator.stats(),
+        "dropped_updates": get_dropped_stats(),
+    }), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus. Требует METRICS_TOKEN (bearer_token в конфиге scrape)."""
+    require_token(METRICS_TOKEN)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 log.info("Запуск HJR-Scanner в режиме Webhook (production)...")
\ No newline at end of file
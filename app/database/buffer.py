@@ -0,0 +1,114 @@
+# app/database/buffer.py
+# Буфер отложенной записи: копит строки и сбрасывает их в БД одной пачкой.
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    Копит строки и передаёт их в flush_rows(rows) пачкой, когда набралось max_rows
+    строк или самая старая строка ждёт дольше max_latency секунд.
+    flush_rows должна вернуть True, если пачка записана; иначе пачка передаётся в on_failure(rows).
+    """
+
+    def __init__(self, name, flush_rows, max_rows, max_latency, on_failure=None):
+        self.name = name
+        self._flush_rows = flush_rows
+        self._on_failure = on_failure
+        self._max_rows = max(max_rows, 1)
+        self._max_latency = max_latency
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # пачки пишутся строго по очереди
+        self._rows = []
+        self._oldest = None
+        self._thread = None
+        self._stopped = False
+        self._flushes = 0
+        self._rows_flushed = 0
+        self._failed_flushes = 0
+        self._rows_failed = 0
+
+    def add(self, row):
+        with self._cond:
+            if self._thread is None and not self._stopped:
+                self._thread = threading.Thread(target=self._run, name=f"flush-{self.name}", daemon=True)
+                self._thread.start()
+            if not self._rows:
+                self._oldest = time.monotonic()
+            self._rows.append(row)
+            # Будим поток на первой строке (чтобы он засёк дедлайн) и при достижении порога.
+            if len(self._rows) == 1 or len(self._rows) >= self._max_rows or self._stopped:
+                self._cond.notify()
+        if self._stopped:
+            # После остановки фонового потока пишем синхронно, чтобы ничего не потерять.
+            self.flush()
+
+    def flush(self):
+        """Синхронно сбрасывает всё, что накоплено к этому моменту."""
+        with self._flush_lock:
+            with self._cond:
+                rows, self._rows, self._oldest = self._rows, [], None
+            if not rows:
+                return True
+            try:
+                ok = self._flush_rows(rows)
+            except Exception as e:
+                log.error(f"Ошибка при сбросе буфера {self.name}: {e}", exc_info=True)
+                ok = False
+            with self._cond:
+                if ok:
+                    self._flushes += 1
+                    self._rows_flushed += len(rows)
+                else:
+                    self._failed_flushes += 1
+                    self._rows_failed += len(rows)
+            if not ok:
+                if self._on_failure is None:
+                    log.error(f"Буфер {self.name}: не удалось записать {len(rows)} строк.")
+                else:
+                    try:
+                        self._on_failure(rows)
+                    except Exception as e:
+                        log.critical(f"Буфер {self.name}: {len(rows)} строк потеряно, резервная запись не удалась: {e}", exc_info=True)
+            return ok
+
+    def stop(self):
+        """Останавливает фоновый поток и сбрасывает остаток буфера."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=self._max_latency + 5)
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pending": len(self._rows),
+                "flushes": self._flushes,
+                "rows_flushed": self._rows_flushed,
+                "failed_flushes": self._failed_flushes,
+                "rows_failed": self._rows_failed,
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if self._rows:
+                        if len(self._rows) >= self._max_rows:
+                            break
+                        remaining = self._oldest + self._max_latency - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                stopped = self._stopped
+            self.flush()
+            if stopped:
+                return
@@ -4,16 +4,269 @@ import psycopg2
 import psycopg2.extras
 import logging
 import json
-from datetime import datetime
+import time
+import threading
+import re
+import gzip
+import atexit
+from contextlib import contextmanager
+from datetime import datetime, date, timezone
 from sshtunnel import SSHTunnelForwarder
+from .buffer import WriteBehindBuffer
+from .spool import Spool
+from .. import metrics
+from ..metrics import timed_query
 
 log = logging.getLogger(__name__)
 tunnel_server = None
+_tunnel_lock = threading.Lock()
+
+# --- Настройки пула соединений ---
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 5))
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", 300))        # сек. простоя до закрытия
+DB_POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", 10)) # сек. ожидания свободного соединения
+DB_POOL_VALIDATE_AFTER = float(os.getenv("DB_POOL_VALIDATE_AFTER", 5))      # пинг, если соединение простаивало дольше
+
+# --- Настройки отложенной записи ---
+MESSAGE_BUFFER_MAX_ROWS = int(os.getenv("MESSAGE_BUFFER_MAX_ROWS", 200))
+MESSAGE_BUFFER_MAX_LATENCY = float(os.getenv("MESSAGE_BUFFER_MAX_LATENCY", 0.5))  # сек.
+
+# --- Настройки секций message_log ---
+MESSAGE_LOG_PARTITIONS_AHEAD = int(os.getenv("MESSAGE_LOG_PARTITIONS_AHEAD", 3))    # сколько месяцев создавать заранее
+MESSAGE_LOG_RETENTION_MONTHS = int(os.getenv("MESSAGE_LOG_RETENTION_MONTHS", 0))    # 0 — хранить всё
+MESSAGE_LOG_ARCHIVE_DIR = os.getenv("MESSAGE_LOG_ARCHIVE_DIR", "archive")
+
+# --- Настройки резервного журнала (spool) и размыкателя ---
+SPOOL_DIR = os.getenv("SPOOL_DIR", "spool")
+SPOOL_FSYNC_EVERY = int(os.getenv("SPOOL_FSYNC_EVERY", 32))          # fsync раз в N записей...
+SPOOL_FSYNC_INTERVAL = float(os.getenv("SPOOL_FSYNC_INTERVAL", 1))   # ...или раз в N секунд
+SPOOL_REPLAY_INTERVAL = float(os.getenv("SPOOL_REPLAY_INTERVAL", 5))
+SPOOL_REPLAY_BATCH_ROWS = int(os.getenv("SPOOL_REPLAY_BATCH_ROWS", 5000))
+DB_BREAKER_FAILURE_THRESHOLD = int(os.getenv("DB_BREAKER_FAILURE_THRESHOLD", 2))  # неудач подряд до размыкания
+DB_BREAKER_COOLDOWN = float(os.getenv("DB_BREAKER_COOLDOWN", 30))                   # сек. до пробного подключения
+
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений с проверкой при выдаче и вытеснением простаивающих."""
+
+    def __init__(self, connect, min_size, max_size, idle_timeout, checkout_timeout, validate_after):
+        self._connect = connect
+        self._min_size = min_size
+        self._max_size = max(max_size, 1)
+        self._idle_timeout = idle_timeout
+        self._checkout_timeout = checkout_timeout
+        self._validate_after = validate_after
+        self._cond = threading.Condition()
+        self._idle = []          # (conn, generation, released_at); в конце — самые свежие
+        self._checked_out = {}   # id(conn) -> generation
+        self._in_use = 0         # выданные соединения + открываемые прямо сейчас
+        self._generation = 0     # растёт при каждом перезапуске туннеля
+        self._checkouts = 0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def acquire(self):
+        """Выдаёт рабочее соединение или None, если БД недоступна или пул исчерпан."""
+        started = time.monotonic()
+        deadline = started + self._checkout_timeout
+        with self._cond:
+            while True:
+                evicted = self._evict_idle_locked()
+                if self._idle:
+                    conn, generation, released_at = self._idle.pop()
+                    break
+                if self._in_use < self._max_size:
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    log.error(f"Пул соединений исчерпан: нет свободного соединения за {self._checkout_timeout} с.")
+                    self._close_all(evicted)
+                    return None
+                self._cond.wait(remaining)
+            self._in_use += 1
+            waited = time.monotonic() - started
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        self._close_all(evicted)
+
+        if conn is not None and time.monotonic() - released_at >= self._validate_after and not self._ping(conn):
+            self._close_all([conn])
+            conn = None
+        if conn is None:
+            conn = self._connect()
+            if conn is None:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                return None
+            with self._cond:
+                self._created += 1
+                generation = self._generation
+        with self._cond:
+            self._checked_out[id(conn)] = generation
+        return conn
+
+    def release(self, conn, discard=False):
+        """Возвращает соединение в пул; сломанные и устаревшие соединения закрываются."""
+        if conn is None:
+            return
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        with self._cond:
+            generation = self._checked_out.pop(id(conn), None)
+            self._in_use -= 1
+            stale = discard or conn.closed or generation != self._generation
+            if not stale:
+                self._idle.append((conn, generation, time.monotonic()))
+            self._cond.notify()
+        if stale:
+            self._close_all([conn])
+
+    def reset(self):
+        """Сбрасывает пул (например, после перезапуска туннеля): старые соединения больше не выдаются."""
+        with self._cond:
+            self._generation += 1
+            stale = [conn for conn, _, _ in self._idle]
+            self._idle = []
+        self._close_all(stale)
+
+    def set_connector(self, connect):
+        """Меняет функцию открытия соединений; уже открытые соединения больше не выдаются."""
+        with self._cond:
+            self._connect = connect
+        self.reset()
+
+    def connect_unpooled(self):
+        """Открывает отдельное соединение тем же способом, что и пул, но не учитывает его в пуле."""
+        with self._cond:
+            connect = self._connect
+        return connect()
+
+    def close(self):
+        self.reset()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "max_size": self._max_size,
+                "generation": self._generation,
+                "checkouts": self._checkouts,
+                "checkout_timeouts": self._timeouts,
+                "connections_created": self._created,
+                "connections_discarded": self._discarded,
+                "wait_time_total": round(self._wait_total, 6),
+                "wait_time_max": round(self._wait_max, 6),
+                "wait_time_avg": round(self._wait_total / self._checkouts, 6) if self._checkouts else 0.0,
+            }
+
+    def _evict_idle_locked(self):
+        """Забирает из пула соединения, простаивающие дольше idle_timeout (не опускаясь ниже min_size)."""
+        now = time.monotonic()
+        evicted = []
+        while self._idle and len(self._idle) + self._in_use > self._min_size:
+            conn, _, released_at = self._idle[0]
+            if now - released_at < self._idle_timeout:
+                break
+            evicted.append(self._idle.pop(0)[0])
+        return evicted
+
+    def _ping(self, conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            log.warning(f"Соединение из пула не прошло проверку и будет пересоздано: {e}")
+            return False
+
+    def _close_all(self, conns):
+        for conn in conns:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+        if conns:
+            with self._cond:
+                self._discarded += len(conns)
+
+
+class CircuitBreaker:
+    """
+    Размыкатель: после failure_threshold неудачных подключений подряд БД считается недоступной,
+    и запросы не тратят время на туннель. Пробное подключение делает фоновый поток раз в cooldown секунд.
+    """
+
+    def __init__(self, failure_threshold, cooldown):
+        self._failure_threshold = max(failure_threshold, 1)
+        self._cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._opened_total = 0
+
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+    def probe_due(self):
+        with self._lock:
+            return self._opened_at is not None and time.monotonic() - self._opened_at >= self._cooldown
+
+    def record_success(self):
+        with self._lock:
+            was_open = self._opened_at is not None
+            self._failures = 0
+            self._opened_at = None
+        if was_open:
+            log.info("Соединение с БД восстановлено, размыкатель замкнут.")
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures < self._failure_threshold:
+                return
+            if self._opened_at is None:
+                self._opened_total += 1
+                log.warning(f"БД недоступна ({self._failures} неудач подряд): записи уходят в spool, повтор через {self._cooldown} с.")
+            self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {"open": self._opened_at is not None, "consecutive_failures": self._failures, "opened_total": self._opened_total}
+
 
 def start_ssh_tunnel():
     global tunnel_server
-    if tunnel_server and tunnel_server.is_active:
-        return
+    with _tunnel_lock:
+        if tunnel_server and tunnel_server.is_active:
+            return
+        if tunnel_server:
+            log.warning("SSH-туннель неактивен, перезапускаю...")
+            try:
+                tunnel_server.stop()
+            except Exception:
+                pass
+            tunnel_server = None
+        _start_ssh_tunnel_locked()
+        # Соединения, открытые через старый туннель, больше не годятся.
+        _pool.reset()
+
+def _start_ssh_tunnel_locked():
+    global tunnel_server
     log.info("Запуск SSH-туннеля для подключения к БД...")
     try:
         tunnel_server = SSHTunnelForwarder(
@@ -24,15 +277,32 @@ def start_ssh_tunnel():
         )
         tunnel_server.start()
         log.info(f"SSH-туннель успешно запущен. Локальный порт: {tunnel_server.local_bind_port}")
+        metrics.SSH_TUNNEL_STARTS.inc("success")
     except Exception as e:
+        metrics.SSH_TUNNEL_STARTS.inc("failure")
         log.critical(f"КРИТИЧЕСКАЯ ОШИБКА: Не удалось запустить SSH-туннель. {e}", exc_info=True)
         tunnel_server = None
 
-def get_db_connection():
+def _open_db_connection():
+    if os.getenv("DB_HOST"):
+        # Прямое подключение без SSH-туннеля (локальный Postgres, бенчмарки).
+        try:
+            return psycopg2.connect(
+                host=os.getenv("DB_HOST"),
+                port=int(os.getenv("DB_PORT", 5432)),
+                user=os.getenv("DB_USER"),
+                password=os.getenv("DB_PASSWORD"),
+                dbname=os.getenv("DB_NAME")
+            )
+        except psycopg2.OperationalError as e:
+            metrics.DB_CONNECT_FAILURES.inc()
+            log.critical(f"КРИТИЧЕСКАЯ ОШИБКА: Не удалось подключиться к базе данных {os.getenv('DB_HOST')}. {e}")
+            return None
     if not (tunnel_server and tunnel_server.is_active):
         start_ssh_tunnel()
         if not (tunnel_server and tunnel_server.is_active):
             log.error("Соединение с БД невозможно: SSH-туннель не активен.")
+            metrics.DB_CONNECT_FAILURES.inc()
             return None
     try:
         conn = psycopg2.connect(
@@ -44,59 +314,802 @@ def get_db_connection():
         )
         return conn
     except psycopg2.OperationalError as e:
+        metrics.DB_CONNECT_FAILURES.inc()
         log.critical(f"КРИТИЧЕСКАЯ ОШИБКА: Не удалось подключиться к базе данных через туннель. {e}")
         return None
 
+_breaker = CircuitBreaker(DB_BREAKER_FAILURE_THRESHOLD, DB_BREAKER_COOLDOWN)
+
+def _guarded(connect):
+    """Оборачивает функцию открытия соединения учётом успехов/неудач в размыкателе."""
+    def guarded_connect():
+        conn = connect()
+        if conn is None:
+            _breaker.record_failure()
+        else:
+            _breaker.record_success()
+        return conn
+    return guarded_connect
+
+_pool = ConnectionPool(
+    _guarded(_open_db_connection),
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    idle_timeout=DB_POOL_IDLE_TIMEOUT,
+    checkout_timeout=DB_POOL_CHECKOUT_TIMEOUT,
+    validate_after=DB_POOL_VALIDATE_AFTER,
+)
+
+def use_connection_factory(connect):
+    """Подменяет способ открытия соединений (бенчмарки, тесты) и сбрасывает пул."""
+    _pool.set_connector(_guarded(connect))
+
+def get_db_connection():
+    """
+    Берёт соединение из пула. Его обязательно нужно вернуть через release_db_connection().
+    Пока размыкатель разомкнут, сразу возвращает None, не трогая туннель.
+    """
+    _ensure_replayer()
+    if _breaker.is_open():
+        return None
+    return _pool.acquire()
+
+def release_db_connection(conn, discard=False):
+    _pool.release(conn, discard=discard)
+
+def open_dedicated_connection():
+    """
+    Отдельное долгоживущее соединение вне пула (например, для сессионной advisory-блокировки,
+    которая держится, пока соединение открыто). None, если БД недоступна. Закрывает вызывающий.
+    """
+    if _breaker.is_open():
+        return None
+    return _pool.connect_unpooled()
+
+def try_advisory_lock(conn, key):
+    """Пытается взять сессионную advisory-блокировку на соединении conn, не дожидаясь её освобождения."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (key,))
+        row = cur.fetchone()
+    conn.commit()
+    return bool(row and row[0])
+
+def connection_alive(conn):
+    """Проверяет, что долгоживущее соединение ещё работает."""
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def get_pool_stats():
+    return _pool.stats()
+
+def get_buffer_stats():
+    return {buf.name: buf.stats() for buf in _buffers()}
+
+def _buffers():
+    return [_message_buffer, _edit_buffer, _member_buffer]
+
+def get_spool_stats():
+    return {"spool": _spool.stats(), "circuit_breaker": _breaker.stats()}
+
+def _collect_metrics():
+    pool = _pool.stats()
+    yield "hjr_db_pool_connections", "Соединения в пуле.", "gauge", {"state": "in_use"}, pool["in_use"]
+    yield "hjr_db_pool_connections", "Соединения в пуле.", "gauge", {"state": "idle"}, pool["idle"]
+    yield "hjr_db_pool_checkouts_total", "Выдачи соединений из пула.", "counter", {}, pool["checkouts"]
+    yield "hjr_db_pool_checkout_timeouts_total", "Таймауты ожидания свободного соединения.", "counter", {}, pool["checkout_timeouts"]
+    yield "hjr_db_pool_wait_seconds_total", "Суммарное ожидание соединения из пула.", "counter", {}, pool["wait_time_total"]
+    for buf in _buffers():
+        stats = buf.stats()
+        yield "hjr_write_buffer_pending_rows", "Строки, ждущие записи в БД.", "gauge", {"buffer": buf.name}, stats["pending"]
+        yield "hjr_write_buffer_rows_flushed_total", "Строки, записанные пачками.", "counter", {"buffer": buf.name}, stats["rows_flushed"]
+        yield "hjr_write_buffer_failed_flushes_total", "Неудачные сбросы буфера.", "counter", {"buffer": buf.name}, stats["failed_flushes"]
+    spool = _spool.stats()
+    yield "hjr_spool_pending_bytes", "Размер ещё не воспроизведённого spool.", "gauge", {}, spool["pending_bytes"]
+    yield "hjr_spool_rows_total", "Строки, записанные в spool и воспроизведённые из него.", "counter", {"op": "appended"}, spool["appended_rows"]
+    yield "hjr_spool_rows_total", "Строки, записанные в spool и воспроизведённые из него.", "counter", {"op": "replayed"}, spool["replayed_rows"]
+    yield "hjr_spool_rows_total", "Строки, записанные в spool и воспроизведённые из него.", "counter", {"op": "quarantined"}, spool["quarantined_rows"]
+    yield "hjr_db_circuit_open", "1, если размыкатель БД разомкнут.", "gauge", {}, int(_breaker.is_open())
+
+metrics.register_collector(_collect_metrics)
+
+def flush_buffers():
+    """Синхронно сбрасывает все буферы отложенной записи."""
+    for buf in _buffers():
+        buf.flush()
+
+def shutdown():
+    """Корректное завершение: дописывает буферы (или spool) и закрывает соединения. Можно вызывать повторно."""
+    _replayer_stop.set()
+    for buf in _buffers():
+        buf.stop()
+    _spool.close()
+    _pool.close()
+
+atexit.register(shutdown)
+
+@timed_query
 def init_db():
+    """Применяет DB_SCHEMA. Возвращает True, если схема применена."""
     conn = get_db_connection()
     if not conn:
         log.error("Инициализация БД пропущена: нет соединения.")
-        return
+        return False
     try:
         with conn.cursor() as cur:
             from .schema import DB_SCHEMA
             log.info("Проверка и инициализация схемы базы данных...")
+            # Схема создаёт секции message_log на столько же месяцев вперёд, сколько и плановое обслуживание.
+            cur.execute("SELECT set_config('hjr.partitions_ahead', %s, true)", (str(MESSAGE_LOG_PARTITIONS_AHEAD),))
             cur.execute(DB_SCHEMA)
             conn.commit()
             log.info("Схема базы данных успешно проверена/инициализирована.")
+        return True
     except Exception as e:
         log.error(f"Ошибка при инициализации схемы БД: {e}")
+        return False
+    finally:
+        release_db_connection(conn)
+
+@timed_query
+def schema_exists():
+    """Проверяет, что схема уже создана (для готовности процессов, которые сами её не применяют)."""
+    conn = get_db_connection()
+    if not conn: return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('message_log') IS NOT NULL AND to_regclass('bot_state') IS NOT NULL")
+            return bool(cur.fetchone()[0])
+    except Exception as e:
+        log.error(f"Не удалось проверить наличие схемы БД: {e}")
+        return False
+    finally:
+        release_db_connection(conn)
+
+def _write_rows(rows_by_kind, state=None):
+    """
+    Пишет строки нескольких видов ({вид: строки}, см. _ROW_WRITERS) и значения bot_state
+    ({ключ: (значение, monotonic)}, см. _write_bot_state) одной транзакцией. True при успехе, False — если БД недоступна или связь оборвалась; в обоих случаях
+    не записывается ничего. Если БД отвергла сами данные, исключение пробрасывается: повтор тут не поможет.
+    """
+    conn = get_db_connection()
+    if not conn: return False
+    try:
+        with conn.cursor() as cur:
+            for kind, rows in rows_by_kind.items():
+                if rows:
+                    _ROW_WRITERS[kind](cur, rows)
+            for key, (value, monotonic) in (state or {}).items():
+                _write_bot_state(cur, key, value, monotonic)
+            conn.commit()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        summary = ", ".join(f"{kind}: {len(rows)}" for kind, rows in rows_by_kind.items() if rows)
+        log.error(f"Ошибка связи с БД при записи пачки ({summary}): {e}")
+        return False
     finally:
-        if conn: conn.close()
+        release_db_connection(conn)
+
+def _write_kind(kind, rows):
+    """
+    Пишет пачку строк одного вида. False — БД недоступна, и пачку нужно сохранить в spool.
+    Если БД отвергла данные, пачка делится пополам, пока отвергнутые строки не останутся по одной:
+    они откладываются в карантин spool (см. Spool.quarantine), остальные записываются.
+    """
+    try:
+        return _write_rows({kind: rows})
+    except Exception as e:
+        if len(rows) == 1:
+            log.error(f"БД отвергла строку {kind} ({e}), строка отложена в карантин spool.")
+            _spool.quarantine(kind, rows, str(e))
+            return True
+        log.warning(f"БД отвергла пачку {kind} из {len(rows)} строк ({e}), пачка записывается по частям.")
+    middle = len(rows) // 2
+    return _write_kind(kind, rows[:middle]) and _write_kind(kind, rows[middle:])
+
+_batch_local = threading.local()
+
+def _buffer_row(kind, buffer, row):
+    """Кладёт строку в пачку queries.batch() текущего потока, если она открыта, иначе — в общий буфер."""
+    current = getattr(_batch_local, "batch", None)
+    if current is not None:
+        current.rows[kind].append(row)
+    else:
+        buffer.add(row)
+
+def _write_message_rows(cur, rows):
+    """Пачка новых сообщений одним INSERT ... VALUES."""
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO message_log (message_id, chat_id, text, created_at, edit_history, user_id) VALUES %s ON CONFLICT (chat_id, message_id, created_at) DO NOTHING;",
+        rows,
+        template="(%s, %s, %s, to_timestamp(%s), %s, %s)",
+        page_size=len(rows)
+    )
 
+@timed_query
+def _insert_message_rows(rows):
+    """Записывает пачку новых сообщений одним INSERT ... VALUES и одним коммитом."""
+    return _write_kind("message_log", rows)
+
+_message_buffer = WriteBehindBuffer(
+    "message_log",
+    _insert_message_rows,
+    max_rows=MESSAGE_BUFFER_MAX_ROWS,
+    max_latency=MESSAGE_BUFFER_MAX_LATENCY,
+    on_failure=lambda rows: _spool_rows("message_log", rows),
+)
+
+@timed_query
 def log_new_message(message):
+    """Ставит сообщение в буфер; в БД оно попадёт со следующей пачкой."""
+    text = message.text or message.caption
+    initial_history = json.dumps([{"timestamp": message.date, "text": text}])
+    user_id = message.from_user.id if message.from_user else None
+    _buffer_row("message_log", _message_buffer, (message.message_id, message.chat.id, text, message.date, initial_history, user_id))
+
+def _write_edit_rows(cur, rows):
+    """Пачка правок в message_edits. Старые правки не перечитываются и не переписываются."""
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO message_edits (chat_id, message_id, edit_date, text) VALUES %s ON CONFLICT (chat_id, message_id, edit_date) DO NOTHING;",
+        rows,
+        template="(%s, %s, to_timestamp(%s), %s)",
+        page_size=len(rows)
+    )
+
+@timed_query
+def _insert_edit_rows(rows):
+    """Дописывает пачку правок в message_edits одним коммитом."""
+    return _write_kind("message_edits", rows)
+
+_edit_buffer = WriteBehindBuffer(
+    "message_edits",
+    _insert_edit_rows,
+    max_rows=MESSAGE_BUFFER_MAX_ROWS,
+    max_latency=MESSAGE_BUFFER_MAX_LATENCY,
+    on_failure=lambda rows: _spool_rows("message_edits", rows),
+)
+
+@timed_query
+def log_edited_message(message):
+    """Ставит правку в буфер; каждая правка — отдельная строка в message_edits."""
+    edit_date = message.edit_date or message.date
+    _buffer_row("message_edits", _edit_buffer, (message.chat.id, message.message_id, edit_date, message.text or message.caption))
+
+# Статусы, при которых пользователь состоит в чате (restricted — только с is_member).
+MEMBER_STATUSES = ("creator", "administrator", "member")
+
+def _write_member_rows(cur, rows):
+    """
+    Пачка событий в chat_member_log плюс обновление chat_membership.
+    В chat_membership по каждой паре (chat_id, user_id) пишется только последнее событие пачки,
+    а более раннее событие не перезаписывает уже сохранённое более позднее.
+    """
+    latest = {}
+    for row in rows:
+        key = (row[0], row[1])
+        if key not in latest or latest[key][7] <= row[7]:
+            latest[key] = row
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO chat_member_log (chat_id, user_id, username, first_name, old_status, new_status, changed_at) "
+        "VALUES %s ON CONFLICT (chat_id, user_id, changed_at, new_status) DO NOTHING;",
+        [(chat_id, user_id, username, first_name, old_status, new_status, changed_at)
+         for chat_id, user_id, username, first_name, old_status, new_status, _, changed_at in rows],
+        template="(%s, %s, %s, %s, %s, %s, to_timestamp(%s))",
+        page_size=len(rows)
+    )
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO chat_membership (chat_id, user_id, username, first_name, status, is_member, updated_at) VALUES %s "
+        "ON CONFLICT (chat_id, user_id) DO UPDATE SET username = EXCLUDED.username, first_name = EXCLUDED.first_name, "
+        "status = EXCLUDED.status, is_member = EXCLUDED.is_member, updated_at = EXCLUDED.updated_at "
+        "WHERE chat_membership.updated_at <= EXCLUDED.updated_at;",
+        [(chat_id, user_id, username, first_name, new_status, is_member, changed_at)
+         for chat_id, user_id, username, first_name, _, new_status, is_member, changed_at in latest.values()],
+        template="(%s, %s, %s, %s, %s, %s, to_timestamp(%s))",
+        page_size=len(latest)
+    )
+
+@timed_query
+def _insert_member_rows(rows):
+    """Одной транзакцией дописывает пачку событий в chat_member_log и обновляет chat_membership."""
+    return _write_kind("chat_member_log", rows)
+
+_member_buffer = WriteBehindBuffer(
+    "chat_member_log",
+    _insert_member_rows,
+    max_rows=MESSAGE_BUFFER_MAX_ROWS,
+    max_latency=MESSAGE_BUFFER_MAX_LATENCY,
+    on_failure=lambda rows: _spool_rows("chat_member_log", rows),
+)
+
+@timed_query
+def log_chat_member_update(update):
+    """Ставит событие chat_member в буфер: оно попадёт в chat_member_log и chat_membership со следующей пачкой."""
+    member = update.new_chat_member
+    user = member.user
+    is_member = member.status in MEMBER_STATUSES or (member.status == "restricted" and bool(getattr(member, "is_member", False)))
+    _buffer_row("chat_member_log", _member_buffer, (
+        update.chat.id, user.id, user.username, user.first_name,
+        update.old_chat_member.status if update.old_chat_member else None,
+        member.status, is_member, update.date,
+    ))
+
+def flush_member_log():
+    """Синхронно дописывает накопленные события участников (перед чтением chat_membership)."""
+    return _member_buffer.flush()
+
+@timed_query
+def get_user_memberships(user_id):
+    """Известное состояние пользователя по чатам: {chat_id: состоит ли в чате}. None, если БД недоступна."""
     conn = get_db_connection()
-    if not conn: return
+    if not conn: return None
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT chat_id, is_member FROM chat_membership WHERE user_id = %s", (user_id,))
+            return dict(cur.fetchall())
+    except Exception as e:
+        log.error(f"Не удалось получить чаты пользователя {user_id}: {e}", exc_info=True)
+        return None
+    finally:
+        release_db_connection(conn)
+
+@timed_query
+def get_user_left_chats(user_id, max_age):
+    """
+    Чаты, из которых пользователь, по chat_membership, вышел не раньше чем max_age секунд назад:
+    множество chat_id. Учитывает и события открытой в этом потоке queries.batch(). None, если БД недоступна.
+    """
+    conn = get_db_connection()
+    if not conn: return None
     try:
         with conn.cursor() as cur:
-            # ... (здесь полная логика из Вашего оригинального файла) ...
-            initial_history = json.dumps([{"timestamp": message.date, "text": message.text or message.caption}])
             cur.execute(
-                "INSERT INTO message_log (message_id, chat_id, text, created_at, edit_history) VALUES (%s, %s, %s, to_timestamp(%s), %s) ON CONFLICT (chat_id, message_id) DO NOTHING;",
-                (message.message_id, message.chat.id, message.text or message.caption, message.date, initial_history)
+                "SELECT chat_id FROM chat_membership "
+                "WHERE user_id = %s AND NOT is_member AND updated_at > NOW() - make_interval(secs => %s)",
+                (user_id, max_age)
             )
-            conn.commit()
+            left = {row[0] for row in cur.fetchall()}
     except Exception as e:
-        log.error(f"Ошибка при логировании нового сообщения: {e}", exc_info=True)
+        log.error(f"Не удалось получить чаты, из которых вышел пользователь {user_id}: {e}", exc_info=True)
+        return None
     finally:
-        if conn: conn.close()
+        release_db_connection(conn)
+    current = getattr(_batch_local, "batch", None)
+    if current is not None:
+        # Внутри queries.batch() события этого потока ещё не в таблице, и они новее сохранённых.
+        cutoff = time.time() - max_age
+        rows = sorted((row for row in current.rows["chat_member_log"] if row[1] == user_id), key=lambda row: row[7])
+        for chat_id, _, _, _, _, _, is_member, changed_at in rows:
+            if not is_member and changed_at > cutoff:
+                left.add(chat_id)
+            else:
+                left.discard(chat_id)
+    return left
 
+@timed_query
+def get_chat_members(chat_id):
+    """Текущие участники чата по данным chat_membership: список (user_id, username, first_name, status). None, если БД недоступна."""
+    conn = get_db_connection()
+    if not conn: return None
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT user_id, username, first_name, status FROM chat_membership "
+                "WHERE chat_id = %s AND is_member ORDER BY user_id",
+                (chat_id,)
+            )
+            return cur.fetchall()
+    except Exception as e:
+        log.error(f"Не удалось получить участников чата {chat_id}: {e}", exc_info=True)
+        return None
+    finally:
+        release_db_connection(conn)
+
+# --- Резервный журнал (spool) ---
+_spool = Spool(SPOOL_DIR, fsync_every=SPOOL_FSYNC_EVERY, fsync_interval=SPOOL_FSYNC_INTERVAL)
+_replayer_thread = None
+_replayer_lock = threading.Lock()
+_replayer_stop = threading.Event()
+
+def _spool_rows(kind, rows):
+    """Сохраняет пачку, которую не удалось записать в БД, в локальный spool."""
+    _spool.append(kind, rows)
+    _ensure_replayer()
+    log.warning(f"{len(rows)} строк ({kind}) сохранено в spool до восстановления БД.")
+
+# Чем воспроизводить записи spool каждого вида. Все вставки идемпотентны (ON CONFLICT DO NOTHING).
+_SPOOL_WRITERS = {
+    "message_log": _insert_message_rows,
+    "message_edits": _insert_edit_rows,
+    "chat_member_log": _insert_member_rows,
+}
+
+# Запись строк каждого вида курсором внутри уже открытой транзакции (см. _write_rows).
+_ROW_WRITERS = {
+    "message_log": _write_message_rows,
+    "message_edits": _write_edit_rows,
+    "chat_member_log": _write_member_rows,
+}
+
+class WriteBatch:
+    """Строки, залогированные в потоке внутри queries.batch(), и значения bot_state для той же транзакции."""
+
+    def __init__(self):
+        self.rows = {kind: [] for kind in _ROW_WRITERS}
+        self.state = {}
+        self.committed = None
+
+    def set_state(self, key, value, monotonic=False):
+        """Значение bot_state для той же транзакции; при monotonic=True оно только растёт (GREATEST)."""
+        self.state[key] = (value, monotonic)
+
+    def row_count(self):
+        return sum(len(rows) for rows in self.rows.values())
+
+@contextmanager
+def batch():
+    """
+    Пока блок открыт, log_new_message/log_edited_message/log_chat_member_update в этом потоке
+    не трогают общие буферы: строки копятся в пачке и при выходе пишутся одной транзакцией
+    вместе с batch.state (например, смещением getUpdates). Если транзакция не удалась, state не сохраняется,
+    а строки уходят в spool (БД недоступна) или пишутся по видам с отсевом отвергнутых строк (см. _write_kind). При исключении внутри блока строки всё равно пишутся, а state отбрасывается.
+    Итог записи — в batch.committed.
+    """
+    current = WriteBatch()
+    _batch_local.batch = current
+    try:
+        yield current
+    except BaseException:
+        current.state.clear()
+        raise
+    finally:
+        _batch_local.batch = None
+        current.committed = _commit_batch(current)
+
+@timed_query
+def _commit_batch(current):
+    if not current.row_count() and not current.state:
+        return True
+    try:
+        if _write_rows(current.rows, current.state):
+            return True
+        rejected = False
+    except Exception as e:
+        log.warning(f"БД отвергла пачку queries.batch() ({e}), строки записываются по видам.")
+        rejected = True
+    for kind, rows in current.rows.items():
+        if rows and not (rejected and _write_kind(kind, rows)):
+            _spool_rows(kind, rows)
+    return False
+
+def _write_spooled(kind, rows):
+    writer = _SPOOL_WRITERS.get(kind)
+    if writer is None:
+        log.error(f"Spool: неизвестный вид записей '{kind}', {len(rows)} строк пропущено.")
+        return True
+    return writer([tuple(row) for row in rows])
+
+def replay_spool():
+    """Один проход воспроизведения: при разомкнутом размыкателе — пробное подключение, затем дозапись spool в БД."""
+    _spool.sync()
+    if _breaker.is_open():
+        if not _breaker.probe_due():
+            return 0
+        conn = _pool.acquire()
+        release_db_connection(conn)
+        if conn is None:
+            return 0
+    if not _spool.has_pending():
+        return 0
+    return _spool.replay(_write_spooled, SPOOL_REPLAY_BATCH_ROWS)
+
+def _replay_loop():
+    while not _replayer_stop.wait(SPOOL_REPLAY_INTERVAL):
+        try:
+            replay_spool()
+        except Exception as e:
+            log.error(f"Ошибка при воспроизведении spool: {e}", exc_info=True)
+
+def _ensure_replayer():
+    global _replayer_thread
+    if _replayer_thread is not None:
+        return
+    with _replayer_lock:
+        if _replayer_thread is None and not _replayer_stop.is_set():
+            _replayer_thread = threading.Thread(target=_replay_loop, name="spool-replayer", daemon=True)
+            _replayer_thread.start()
+
+@timed_query
+def get_message_history(chat_id, message_id):
+    """Возвращает исходный текст сообщения и все его правки в хронологическом порядке."""
+    conn = get_db_connection()
+    if not conn: return None
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT created_at, text FROM message_log WHERE chat_id = %s AND message_id = %s "
+                "UNION ALL "
+                "SELECT edit_date, text FROM message_edits WHERE chat_id = %s AND message_id = %s "
+                "ORDER BY 1",
+                (chat_id, message_id, chat_id, message_id)
+            )
+            return [{"timestamp": row[0], "text": row[1]} for row in cur.fetchall()]
+    except Exception as e:
+        log.error(f"Не удалось получить историю сообщения {chat_id}/{message_id}: {e}", exc_info=True)
+        return None
+    finally:
+        release_db_connection(conn)
+
+_MESSAGE_COLUMNS = "chat_id, message_id, user_id, created_at, text"
+
+def _message_filters(chat_id=None, user_id=None, since=None, until=None, text=None):
+    """Условия WHERE для выборок из message_log; пустые фильтры пропускаются."""
+    clauses, params = [], []
+    if chat_id is not None:
+        clauses.append("chat_id = %s")
+        params.append(chat_id)
+    if user_id is not None:
+        clauses.append("user_id = %s")
+        params.append(user_id)
+    if since is not None:
+        clauses.append("created_at >= %s")
+        params.append(since)
+    if until is not None:
+        clauses.append("created_at < %s")
+        params.append(until)
+    if text:
+        # То же выражение, что и в индексе message_log_search_idx (schema.py), иначе индекс не используется.
+        clauses.append("to_tsvector('russian', coalesce(text, '')) @@ websearch_to_tsquery('russian', %s)")
+        params.append(text)
+    return clauses, params
+
+@timed_query
+def search_messages(filters, limit, after=None):
+    """
+    Страница сообщений по фильтрам (см. _message_filters), от новых к старым.
+    after — ключ (created_at, chat_id, message_id) последней строки предыдущей страницы:
+    продолжение идёт по индексу, без OFFSET. Возвращает список кортежей или None, если БД недоступна.
+    """
+    clauses, params = _message_filters(**filters)
+    if after is not None:
+        clauses.append("(created_at, chat_id, message_id) < (%s, %s, %s)")
+        params.extend(after)
+    where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+    conn = get_db_connection()
+    if not conn: return None
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT {_MESSAGE_COLUMNS} FROM message_log {where}"
+                "ORDER BY created_at DESC, chat_id DESC, message_id DESC LIMIT %s",
+                params + [limit]
+            )
+            return cur.fetchall()
+    except Exception as e:
+        log.error(f"Ошибка поиска сообщений: {e}", exc_info=True)
+        return None
+    finally:
+        release_db_connection(conn)
+
+def export_messages(filters, chunk_rows):
+    """
+    Выгрузка всех сообщений по фильтрам в хронологическом порядке через именованный (серверный) курсор.
+    Возвращает генератор пачек по chunk_rows строк — в памяти одновременно только одна пачка —
+    или None, если БД недоступна. Выгрузка идёт на отдельном соединении вне пула: медленное скачивание
+    не должно занимать соединения, нужные для записи. Соединение закрывается, когда генератор исчерпан или закрыт.
+    """
+    clauses, params = _message_filters(**filters)
+    where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+    conn = open_dedicated_connection()
+    if not conn: return None
+    return _stream_rows(
+        conn,
+        f"SELECT {_MESSAGE_COLUMNS} FROM message_log {where}ORDER BY created_at, chat_id, message_id",
+        params,
+        chunk_rows,
+    )
+
+def _stream_rows(conn, sql, params, chunk_rows):
+    try:
+        with conn.cursor(name=f"export_{threading.get_ident()}_{time.monotonic_ns()}") as cur:
+            cur.itersize = chunk_rows
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                yield rows
+    finally:
+        conn.close()
+
+@timed_query
 def update_editor_list(editors_with_roles: list):
-    """Полностью перезаписывает список редакторов в БД, сохраняя их статус неактивности."""
+    """
+    Приводит таблицу editors к текущему списку администраторов, записывая только разницу:
+    новые и изменившиеся редакторы вставляются/обновляются через upsert, ушедшие удаляются.
+    added_at и is_inactive у существующих записей не трогаются.
+    """
     conn = get_db_connection()
     if not conn: return
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT user_id, is_inactive FROM editors")
-            existing_statuses = {row[0]: row[1] for row in cur.fetchall()}
-            cur.execute("TRUNCATE TABLE editors;")
-            if editors_with_roles:
-                editor_data = [(e['user'].id, e['user'].username, e['user'].first_name, e['role'], existing_statuses.get(e['user'].id, False)) for e in editors_with_roles]
-                psycopg2.extras.execute_values(cur, "INSERT INTO editors (user_id, username, first_name, role, is_inactive) VALUES %s", editor_data)
+            cur.execute("SELECT user_id, username, first_name, role FROM editors")
+            stored = {row[0]: tuple(row[1:]) for row in cur.fetchall()}
+            current = {e['user'].id: (e['user'].username, e['user'].first_name, e['role']) for e in editors_with_roles}
+            changed = [(user_id,) + fields for user_id, fields in current.items() if stored.get(user_id) != fields]
+            removed = [user_id for user_id in stored if user_id not in current]
+            if changed:
+                psycopg2.extras.execute_values(
+                    cur,
+                    "INSERT INTO editors (user_id, username, first_name, role) VALUES %s "
+                    "ON CONFLICT (user_id) DO UPDATE SET username = EXCLUDED.username, first_name = EXCLUDED.first_name, role = EXCLUDED.role",
+                    changed
+                )
+            if removed:
+                cur.execute("DELETE FROM editors WHERE user_id = ANY(%s)", (removed,))
             conn.commit()
-            log.info(f"Список редакторов в БД обновлен. Загружено {len(editors_with_roles)} пользователей.")
+            log.info(f"Список редакторов в БД синхронизирован: {len(current)} редакторов, изменено {len(changed)}, удалено {len(removed)}.")
     except Exception as e:
         log.error(f"Не удалось обновить список редакторов: {e}", exc_info=True)
         if conn: conn.rollback()
     finally:
-        if conn: conn.close()
\ No newline at end of file
+        release_db_connection(conn)
+
+@timed_query
+def upsert_editor(user, role):
+    """Добавляет или обновляет одного редактора (по событию chat_member в редакторском чате)."""
+    conn = get_db_connection()
+    if not conn: return
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO editors (user_id, username, first_name, role) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (user_id) DO UPDATE SET username = EXCLUDED.username, first_name = EXCLUDED.first_name, role = EXCLUDED.role",
+                (user.id, user.username, user.first_name, role)
+            )
+            conn.commit()
+    except Exception as e:
+        log.error(f"Не удалось обновить редактора {user.id}: {e}", exc_info=True)
+    finally:
+        release_db_connection(conn)
+
+@timed_query
+def remove_editor(user_id):
+    """Удаляет редактора из таблицы editors."""
+    conn = get_db_connection()
+    if not conn: return
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM editors WHERE user_id = %s", (user_id,))
+            conn.commit()
+    except Exception as e:
+        log.error(f"Не удалось удалить редактора {user_id}: {e}", exc_info=True)
+    finally:
+        release_db_connection(conn)
+
+@timed_query
+def get_bot_state(key, max_age_days=None):
+    """
+    Читает служебное значение из bot_state. Возвращает 0, если значения нет (или оно старше max_age_days),
+    и None, если БД недоступна.
+    """
+    conn = get_db_connection()
+    if not conn: return None
+    try:
+        with conn.cursor() as cur:
+            if max_age_days is None:
+                cur.execute("SELECT value FROM bot_state WHERE key = %s", (key,))
+            else:
+                cur.execute(
+                    "SELECT value FROM bot_state WHERE key = %s AND updated_at > NOW() - make_interval(days => %s)",
+                    (key, max_age_days)
+                )
+            row = cur.fetchone()
+            return row[0] if row else 0
+    except Exception as e:
+        log.error(f"Не удалось прочитать bot_state[{key}]: {e}", exc_info=True)
+        return None
+    finally:
+        release_db_connection(conn)
+
+def _write_bot_state(cur, key, value, monotonic=False):
+    update = "GREATEST(bot_state.value, EXCLUDED.value)" if monotonic else "EXCLUDED.value"
+    cur.execute(
+        "INSERT INTO bot_state (key, value) VALUES (%s, %s) "
+        f"ON CONFLICT (key) DO UPDATE SET value = {update}, updated_at = NOW()",
+        (key, value)
+    )
+
+@timed_query
+def set_bot_state(key, value, monotonic=False):
+    """Сохраняет служебное значение. При monotonic=True значение только растёт (GREATEST). True при успехе."""
+    conn = get_db_connection()
+    if not conn: return False
+    try:
+        with conn.cursor() as cur:
+            _write_bot_state(cur, key, value, monotonic)
+            conn.commit()
+        return True
+    except Exception as e:
+        log.error(f"Не удалось сохранить bot_state[{key}]: {e}", exc_info=True)
+        return False
+    finally:
+        release_db_connection(conn)
+
+_PARTITION_RE = re.compile(r'^message_log_p(\d{4})(\d{2})$')
+
+def _months_before(day, months):
+    """Первое число месяца, отстоящего от day на months месяцев назад."""
+    total = day.year * 12 + day.month - 1 - months
+    return date(total // 12, total % 12 + 1, 1)
+
+def _archive_partition(conn, name):
+    """Потоково выгружает секцию через COPY в gzip-файл. Возвращает путь к архиву."""
+    os.makedirs(MESSAGE_LOG_ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(MESSAGE_LOG_ARCHIVE_DIR, f"{name}.csv.gz")
+    tmp_path = path + ".tmp"
+    with conn.cursor() as cur, gzip.open(tmp_path, 'wb') as out:
+        cur.copy_expert(f'COPY "{name}" TO STDOUT WITH (FORMAT csv, HEADER)', out)
+    with open(tmp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+@timed_query
+def maintain_message_log_partitions():
+    """
+    Создаёт секции message_log на MESSAGE_LOG_PARTITIONS_AHEAD месяцев вперёд и, если задан срок хранения,
+    отцепляет секции старше MESSAGE_LOG_RETENTION_MONTHS, выгружает их в MESSAGE_LOG_ARCHIVE_DIR и удаляет.
+    Секция удаляется только после успешной выгрузки.
+    Строки в message_log_default (например, сообщения старше первой созданной секции) и в message_log_legacy
+    срок хранения не затрагивает: они остаются, пока их не разнесут или не удалят вручную.
+    """
+    conn = get_db_connection()
+    if not conn: return
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT message_log_ensure_partitions(%s)", (MESSAGE_LOG_PARTITIONS_AHEAD,))
+            created = cur.fetchone()[0]
+            conn.commit()
+        if created:
+            log.info(f"Создано секций message_log: {created}.")
+        if MESSAGE_LOG_RETENTION_MONTHS <= 0:
+            return
+
+        cutoff = _months_before(datetime.now(timezone.utc).date(), MESSAGE_LOG_RETENTION_MONTHS)
+        with conn.cursor() as cur:
+            # И прицепленные, и уже отцепленные (но не удалённые после сбоя выгрузки) секции.
+            cur.execute(
+                "SELECT c.relname, i.inhparent IS NOT NULL FROM pg_class c "
+                "LEFT JOIN pg_inherits i ON i.inhrelid = c.oid "
+                "WHERE c.relname ~ '^message_log_p[0-9]{6}$' AND c.relkind = 'r' AND c.relnamespace = current_schema()::regnamespace"
+            )
+            partitions = cur.fetchall()
+            conn.commit()
+        for name, attached in sorted(partitions):
+            year, month = map(int, _PARTITION_RE.match(name).groups())
+            if date(year, month, 1) >= cutoff:
+                continue
+            if attached:
+                with conn.cursor() as cur:
+                    cur.execute(f'ALTER TABLE message_log DETACH PARTITION "{name}"')
+                conn.commit()
+            path = _archive_partition(conn, name)
+            conn.commit()
+            with conn.cursor() as cur:
+                cur.execute(f'DROP TABLE "{name}"')
+            conn.commit()
+            log.info(f"Секция {name} выгружена в {path} и удалена.")
+    except Exception as e:
+        log.error(f"Ошибка обслуживания секций message_log: {e}", exc_info=True)
+    finally:
+        release_db_connection(conn)
@@ -1,7 +1,147 @@
 # app/database/schema.py
 DB_SCHEMA = """
-            CREATE TABLE IF NOT EXISTS message_log (...); -- Ваш существующий код
-            CREATE TABLE IF NOT EXISTS chat_member_log (...); -- Ваш существующий код
+            -- message_log секционирована по месяцам created_at: старые месяцы удаляются целыми секциями.
+            -- Создаёт секции message_log_pYYYYMM с текущего месяца на months_ahead месяцев вперёд.
+            CREATE OR REPLACE FUNCTION message_log_ensure_partitions(months_ahead INT) RETURNS INT AS $$
+            DECLARE
+                first_month DATE := date_trunc('month', NOW())::date;
+                part_start DATE;
+                part_name TEXT;
+                created INT := 0;
+            BEGIN
+                FOR i IN 0..months_ahead LOOP
+                    part_start := first_month + make_interval(months => i);
+                    part_name := 'message_log_p' || to_char(part_start, 'YYYYMM');
+                    IF to_regclass(part_name) IS NULL THEN
+                        BEGIN
+                            EXECUTE format('CREATE TABLE %I PARTITION OF message_log FOR VALUES FROM (%L) TO (%L)',
+                                           part_name, part_start, part_start + make_interval(months => 1));
+                            created := created + 1;
+                        EXCEPTION WHEN check_violation THEN
+                            -- В message_log_default уже есть строки за этот месяц; их нужно разнести вручную.
+                            RAISE WARNING 'Не удалось создать секцию %: в message_log_default есть строки за этот месяц', part_name;
+                        END;
+                    END IF;
+                END LOOP;
+                RETURN created;
+            END
+            $$ LANGUAGE plpgsql;
+            -- Переход со старой несекционированной message_log: она становится секцией
+            -- message_log_legacy за всё время до начала текущего месяца.
+            DO $$
+            DECLARE
+                boundary TIMESTAMPTZ := date_trunc('month', NOW());
+                mismatch TEXT;
+            BEGIN
+                IF EXISTS (SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                           WHERE c.relname = 'message_log' AND n.nspname = current_schema() AND c.relkind = 'r') THEN
+                    -- ATTACH требует ровно тех же колонок и типов, что у новой таблицы; иначе — понятная ошибка,
+                    -- а не общая ошибка ATTACH на каждом запуске.
+                    SELECT string_agg(coalesce(a.attname || ' ' || format_type(a.atttypid, a.atttypmod), 'нет ' || e.name), ', ')
+                        INTO mismatch
+                        FROM (SELECT * FROM pg_attribute WHERE attrelid = 'message_log'::regclass AND attnum > 0 AND NOT attisdropped) a
+                        FULL JOIN (VALUES ('message_id', 'bigint'), ('chat_id', 'bigint'), ('text', 'text'),
+                                          ('created_at', 'timestamp with time zone'), ('edit_history', 'jsonb')) e(name, type)
+                          ON e.name = a.attname AND e.type = format_type(a.atttypid, a.atttypmod)
+                        WHERE a.attname IS NULL OR e.name IS NULL;
+                    IF mismatch IS NOT NULL THEN
+                        RAISE EXCEPTION 'Старую message_log нельзя сделать секцией: колонки не совпадают (%)', mismatch
+                            USING HINT = 'Нужны ровно message_id bigint, chat_id bigint, text text, created_at timestamptz, edit_history jsonb; лишние колонки удалите или перенесите вручную.';
+                    END IF;
+                    ALTER TABLE message_log RENAME TO message_log_legacy;
+                    -- Ключ секционированной таблицы включает created_at, а в старой он мог быть NULL:
+                    -- такие строки получают время из первой записи edit_history, а без неё — начало эпохи.
+                    UPDATE message_log_legacy SET created_at = CASE
+                            WHEN edit_history -> 0 ->> 'timestamp' ~ '^[0-9]+([.][0-9]+)?$'
+                                THEN to_timestamp((edit_history -> 0 ->> 'timestamp')::double precision)
+                            ELSE 'epoch'::timestamptz END
+                        WHERE created_at IS NULL;
+                    ALTER TABLE message_log_legacy ALTER COLUMN message_id SET NOT NULL,
+                                                   ALTER COLUMN chat_id SET NOT NULL,
+                                                   ALTER COLUMN created_at SET NOT NULL;
+                    -- Старый ключ (chat_id, message_id) заменяется ключом секционированной таблицы при ATTACH.
+                    ALTER TABLE message_log_legacy DROP CONSTRAINT IF EXISTS message_log_pkey;
+                    CREATE TABLE message_log (
+                                                   message_id BIGINT NOT NULL,
+                                                   chat_id BIGINT NOT NULL,
+                                                   text TEXT,
+                                                   created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                                                   edit_history JSONB,
+                                                   PRIMARY KEY (chat_id, message_id, created_at)
+                        ) PARTITION BY RANGE (created_at);
+                    PERFORM message_log_ensure_partitions(coalesce(nullif(current_setting('hjr.partitions_ahead', true), '')::int, 3));
+                    INSERT INTO message_log (message_id, chat_id, text, created_at, edit_history)
+                        SELECT message_id, chat_id, text, created_at, edit_history FROM message_log_legacy WHERE created_at >= boundary;
+                    DELETE FROM message_log_legacy WHERE created_at >= boundary;
+                    EXECUTE format('ALTER TABLE message_log_legacy ADD CONSTRAINT message_log_legacy_range CHECK (created_at < %L)', boundary);
+                    EXECUTE format('ALTER TABLE message_log ATTACH PARTITION message_log_legacy FOR VALUES FROM (MINVALUE) TO (%L)', boundary);
+                END IF;
+            END
+            $$;
+            CREATE TABLE IF NOT EXISTS message_log (
+                                                   message_id BIGINT NOT NULL,
+                                                   chat_id BIGINT NOT NULL,
+                                                   text TEXT,
+                                                   created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                                                   edit_history JSONB,
+                                                   PRIMARY KEY (chat_id, message_id, created_at)
+                ) PARTITION BY RANGE (created_at);
+            -- Сюда попадают сообщения с датой вне заранее созданных секций (например, старше срока хранения),
+            -- чтобы вставка никогда не падала.
+            CREATE TABLE IF NOT EXISTS message_log_default PARTITION OF message_log DEFAULT;
+            -- Сколько месяцев вперёд — MESSAGE_LOG_PARTITIONS_AHEAD (init_db передаёт его в hjr.partitions_ahead),
+            -- дальше секции поддерживает maintain_message_log_partitions с той же настройкой.
+            SELECT message_log_ensure_partitions(coalesce(nullif(current_setting('hjr.partitions_ahead', true), '')::int, 3));
+            -- Колонки и индексы для поиска (app/api.py). Добавляются на родительскую таблицу
+            -- и сами расходятся по всем секциям, включая будущие. Колонка без значения по умолчанию
+            -- добавляется без перезаписи строк; построение индексов на большой message_log_legacy
+            -- блокирует вставку на время построения — один раз, при первом запуске.
+            ALTER TABLE message_log ADD COLUMN IF NOT EXISTS user_id BIGINT;
+            -- Полнотекстовый поиск — индекс по выражению, а не хранимая колонка: STORED-колонка
+            -- переписывала бы все секции под ACCESS EXCLUSIVE. Выражение должно совпадать с _message_filters.
+            CREATE INDEX IF NOT EXISTS message_log_search_idx ON message_log
+                USING GIN (to_tsvector('russian', coalesce(text, '')));
+            CREATE INDEX IF NOT EXISTS message_log_chat_created_idx ON message_log (chat_id, created_at);
+            CREATE INDEX IF NOT EXISTS message_log_user_created_idx ON message_log (user_id, created_at);
+            -- История правок пишется только добавлением строк: каждая правка — отдельная строка.
+            -- Первичный ключ заодно служит индексом для выборки всей истории сообщения одним range scan.
+            CREATE TABLE IF NOT EXISTS message_edits (
+                                                   chat_id BIGINT NOT NULL,
+                                                   message_id BIGINT NOT NULL,
+                                                   edit_date TIMESTAMPTZ NOT NULL,
+                                                   text TEXT,
+                                                   PRIMARY KEY (chat_id, message_id, edit_date)
+                );
+            CREATE TABLE IF NOT EXISTS chat_member_log (
+                                                   id BIGSERIAL PRIMARY KEY,
+                                                   chat_id BIGINT NOT NULL,
+                                                   user_id BIGINT NOT NULL,
+                                                   username TEXT,
+                                                   first_name TEXT,
+                                                   old_status TEXT,
+                                                   new_status TEXT NOT NULL,
+                                                   changed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+            -- Ключ события: повторная запись той же пачки (например, из spool) не создаёт дублей.
+            CREATE UNIQUE INDEX IF NOT EXISTS chat_member_log_event_idx ON chat_member_log (chat_id, user_id, changed_at, new_status);
+            -- Текущее состояние участника в каждом чате — последнее событие из chat_member_log.
+            CREATE TABLE IF NOT EXISTS chat_membership (
+                                                   chat_id BIGINT NOT NULL,
+                                                   user_id BIGINT NOT NULL,
+                                                   username TEXT,
+                                                   first_name TEXT,
+                                                   status TEXT NOT NULL,
+                                                   is_member BOOLEAN NOT NULL,
+                                                   updated_at TIMESTAMPTZ NOT NULL,
+                                                   PRIMARY KEY (chat_id, user_id)
+                );
+            CREATE INDEX IF NOT EXISTS chat_membership_user_idx ON chat_membership (user_id);
+            -- Служебные значения бота (например, максимальный обработанный update_id).
+            CREATE TABLE IF NOT EXISTS bot_state (
+                                                   key TEXT PRIMARY KEY,
+                                                   value BIGINT NOT NULL,
+                                                   updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
             CREATE TABLE IF NOT EXISTS editors (
                                                    user_id BIGINT PRIMARY KEY,
                                                    username TEXT,
@@ -10,4 +150,4 @@ DB_SCHEMA = """
                                                    is_inactive BOOLEAN DEFAULT FALSE,
                                                    added_at TIMESTAMPTZ DEFAULT NOW()
                 ); \
-            """
\ No newline at end of file
+            """
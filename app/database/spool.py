@@ -0,0 +1,262 @@
+# app/database/spool.py
+# Локальный журнал (spool) для записей, которые не удалось сохранить в БД.
+# Формат файла: последовательность записей [4 байта длины, big-endian][JSON {"kind": ..., "rows": [...]}].
+import os
+import re
+import json
+import time
+import struct
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('>I')
+_ACTIVE_RE = re.compile(r'^spool-(\d+)\.log$')
+_REPLAY_RE = re.compile(r'^replay-(\d+)-(\d+)\.log$')
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_records(path):
+    """Читает записи файла по порядку: (kind, rows, смещение конца записи). Оборванный хвост пропускается."""
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(_HEADER.size)
+            if not header:
+                return
+            if len(header) < _HEADER.size:
+                log.warning(f"Spool {path}: оборванный заголовок записи в конце файла, хвост пропущен.")
+                return
+            (length,) = _HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                log.warning(f"Spool {path}: оборванная запись в конце файла, хвост пропущен.")
+                return
+            record = json.loads(payload)
+            yield record["kind"], record["rows"], f.tell()
+
+
+class Spool:
+    """
+    Журнал только на дозапись. У каждого процесса свой активный файл spool-<pid>.log;
+    перед воспроизведением он переименовывается в replay-<pid>-<n>.log, а новые записи идут в свежий файл.
+    Файлы умерших процессов подбираются любым живым процессом.
+    """
+
+    def __init__(self, directory, fsync_every, fsync_interval):
+        self._directory = directory
+        self._fsync_every = max(fsync_every, 1)
+        self._fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._seq = 0
+        self._appended_records = 0
+        self._appended_rows = 0
+        self._replayed_rows = 0
+        self._quarantined_rows = 0
+
+    @property
+    def _active_path(self):
+        return os.path.join(self._directory, f"spool-{os.getpid()}.log")
+
+    def append(self, kind, rows):
+        """Дописывает пачку строк. fsync выполняется не на каждую запись, а раз в fsync_every записей или fsync_interval секунд."""
+        payload = json.dumps({"kind": kind, "rows": rows}, ensure_ascii=False, default=str).encode('utf-8')
+        with self._lock:
+            if self._file is None:
+                os.makedirs(self._directory, exist_ok=True)
+                self._file = open(self._active_path, 'ab')
+            self._file.write(_HEADER.pack(len(payload)) + payload)
+            self._file.flush()
+            self._unsynced += 1
+            self._appended_records += 1
+            self._appended_rows += len(rows)
+            if self._unsynced >= self._fsync_every or time.monotonic() - self._last_sync >= self._fsync_interval:
+                self._sync_locked()
+
+    def quarantine(self, kind, rows, reason):
+        """
+        Откладывает строки, которые БД отвергла (а не просто была недоступна), в quarantine-<pid>.log
+        того же формата, с причиной в поле "error". Такие файлы не воспроизводятся — только ручной разбор,
+        как и .corrupt.
+        """
+        payload = json.dumps({"kind": kind, "rows": rows, "error": reason}, ensure_ascii=False, default=str).encode('utf-8')
+        with self._lock:
+            os.makedirs(self._directory, exist_ok=True)
+            with open(os.path.join(self._directory, f"quarantine-{os.getpid()}.log"), 'ab') as f:
+                f.write(_HEADER.pack(len(payload)) + payload)
+                f.flush()
+                os.fsync(f.fileno())
+            self._quarantined_rows += len(rows)
+
+    def sync(self):
+        with self._lock:
+            if self._unsynced:
+                self._sync_locked()
+
+    def has_pending(self):
+        with self._lock:
+            if self._file is not None and self._file.tell() > 0:
+                return True
+        return bool(self._claimable_files(include_active=True))
+
+    def replay(self, write_batch, batch_rows):
+        """
+        Воспроизводит накопленные записи: write_batch(kind, rows) должна вернуть True при успехе.
+        Строки одного вида объединяются в пачки до batch_rows. При ошибке недописанный остаток сохраняется.
+        Возвращает число воспроизведённых строк.
+        """
+        self._rotate()
+        replayed = 0
+        for path in self._claimable_files(include_active=True):
+            path = self._claim(path)
+            if path is None:
+                continue
+            done, ok = self._replay_file(path, write_batch, batch_rows)
+            replayed += done
+            if not ok:
+                break
+        with self._lock:
+            self._replayed_rows += replayed
+        return replayed
+
+    def stats(self):
+        pending_bytes = 0
+        for path in self._claimable_files(include_active=True) + [self._active_path]:
+            try:
+                pending_bytes += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            return {
+                "pending_bytes": pending_bytes,
+                "appended_records": self._appended_records,
+                "appended_rows": self._appended_rows,
+                "replayed_rows": self._replayed_rows,
+                "quarantined_rows": self._quarantined_rows,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._sync_locked()
+                self._file.close()
+                self._file = None
+
+    def _sync_locked(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _next_replay_path(self):
+        self._seq += 1
+        return os.path.join(self._directory, f"replay-{os.getpid()}-{int(time.time())}{self._seq:04d}.log")
+
+    def _rotate(self):
+        """Закрывает активный файл и переименовывает его в replay-файл."""
+        with self._lock:
+            if self._file is None:
+                return
+            self._sync_locked()
+            self._file.close()
+            self._file = None
+            os.replace(self._active_path, self._next_replay_path())
+
+    def _claimable_files(self, include_active):
+        """
+        Replay-файлы этого процесса и файлы (любого вида) умерших процессов, отсортированные по имени:
+        сгруппированы по pid, внутри процесса — в порядке создания. Порядок между процессами не важен:
+        вставки идемпотентны, а chat_membership не перезаписывается более ранним событием.
+        """
+        try:
+            names = sorted(os.listdir(self._directory))
+        except FileNotFoundError:
+            return []
+        me = os.getpid()
+        paths = []
+        for name in names:
+            replay = _REPLAY_RE.match(name)
+            active = _ACTIVE_RE.match(name)
+            if replay:
+                pid = int(replay.group(1))
+                if pid == me or not _pid_alive(pid):
+                    paths.append(os.path.join(self._directory, name))
+            elif active and include_active:
+                pid = int(active.group(1))
+                if pid != me and not _pid_alive(pid):
+                    paths.append(os.path.join(self._directory, name))
+        return paths
+
+    def _claim(self, path):
+        """Атомарно забирает файл себе переименованием; None, если его успел забрать другой процесс."""
+        replay = _REPLAY_RE.match(os.path.basename(path))
+        if replay and int(replay.group(1)) == os.getpid():
+            return path
+        with self._lock:
+            target = self._next_replay_path()
+        try:
+            os.rename(path, target)
+        except FileNotFoundError:
+            return None
+        return target
+
+    def _replay_file(self, path, write_batch, batch_rows):
+        pending, pending_count, committed_offset, replayed = {}, 0, 0, 0
+        try:
+            for kind, rows, offset in read_records(path):
+                pending.setdefault(kind, []).extend(rows)
+                pending_count += len(rows)
+                if pending_count >= batch_rows:
+                    if not self._write_pending(pending, write_batch):
+                        self._truncate_head(path, committed_offset)
+                        return replayed, False
+                    replayed += pending_count
+                    pending, pending_count, committed_offset = {}, 0, offset
+            if pending and not self._write_pending(pending, write_batch):
+                self._truncate_head(path, committed_offset)
+                return replayed, False
+            replayed += pending_count
+        except (ValueError, KeyError) as e:
+            log.error(f"Spool {path}: повреждённая запись ({e}), файл отложен для ручного разбора.")
+            os.replace(path, path + ".corrupt")
+            return replayed, True
+        os.remove(path)
+        log.info(f"Spool {path}: воспроизведено {replayed} строк.")
+        return replayed, True
+
+    @staticmethod
+    def _write_pending(pending, write_batch):
+        # Если упадёт запись второго вида, первый при повторе запишется ещё раз —
+        # это безопасно, т.к. все вставки идут с ON CONFLICT DO NOTHING.
+        for kind, rows in pending.items():
+            if not write_batch(kind, rows):
+                return False
+        return True
+
+    @staticmethod
+    def _truncate_head(path, offset):
+        """Убирает из файла уже записанное в БД начало, чтобы при следующей попытке не писать его повторно."""
+        if offset == 0:
+            return
+        tmp_path = path + ".tmp"
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            src.seek(offset)
+            while True:
+                chunk = src.read(1 << 20)
+                if not chunk:
+                    break
+                dst.write(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, path)
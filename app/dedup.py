@@ -0,0 +1,126 @@
+# app/dedup.py
+# Отсев повторно доставленных апдейтов по update_id.
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+UPDATE_DEDUP_LRU_SIZE = int(os.getenv("UPDATE_DEDUP_LRU_SIZE", 10000))
+UPDATE_HWM_PERSIST_INTERVAL = float(os.getenv("UPDATE_HWM_PERSIST_INTERVAL", 5))  # сек.
+# Насколько ниже сохранённой отметки update_id ещё считается повтором. Telegram может начать
+# нумерацию заново после недели без апдейтов — такие id окажутся далеко внизу и пройдут.
+UPDATE_DEDUP_FLOOR_WINDOW = int(os.getenv("UPDATE_DEDUP_FLOOR_WINDOW", 1000000))
+
+
+class UpdateDeduplicator:
+    """
+    Недавние update_id хранятся в ограниченном LRU. Максимальный принятый id периодически
+    сохраняется (load_hwm/save_hwm), и после перезапуска всё, что не выше этой отметки, считается повтором.
+    Апдейт, который не удалось принять (503/500), нужно вернуть через forget(), иначе повтор Telegram
+    будет отброшен как дубль; отметку двигает только accept().
+    """
+
+    def __init__(self, load_hwm, save_hwm, lru_size, persist_interval, floor_window):
+        self._load_hwm = load_hwm
+        self._save_hwm = save_hwm
+        self._lru_size = max(lru_size, 1)
+        self._persist_interval = persist_interval
+        self._floor_window = floor_window
+        self._lock = threading.Lock()
+        self._recent = OrderedDict()
+        self._floor = None        # отметка, загруженная из БД; None — ещё не загружена
+        self._max_seen = 0
+        self._persisted = 0
+        self._skipped_recent = 0
+        self._skipped_floor = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    def is_duplicate(self, update_id):
+        """
+        Проверяет update_id и запоминает его, чтобы параллельный повтор не обработался дважды.
+        True — апдейт уже был, обрабатывать не нужно. Дальше — accept() или forget().
+        """
+        self._ensure_started()
+        with self._lock:
+            if update_id in self._recent:
+                self._recent.move_to_end(update_id)
+                self._skipped_recent += 1
+                return True
+            floor = self._floor
+            if floor and floor - self._floor_window < update_id <= floor:
+                self._skipped_floor += 1
+                return True
+            self._recent[update_id] = None
+            if len(self._recent) > self._lru_size:
+                self._recent.popitem(last=False)
+            return False
+
+    def accept(self, update_id):
+        """Апдейт принят (обработан или поставлен в очередь): отметка может дойти до него."""
+        with self._lock:
+            if update_id > self._max_seen:
+                self._max_seen = update_id
+
+    def forget(self, update_id):
+        """Апдейт не принят (Telegram получит 503/500 и пришлёт его снова): повтор не считается дублем."""
+        with self._lock:
+            self._recent.pop(update_id, None)
+
+    def high_water_mark(self):
+        with self._lock:
+            return max(self._max_seen, self._floor or 0)
+
+    def persist(self):
+        """Сохраняет максимальный принятый update_id, если он вырос с прошлого раза."""
+        with self._lock:
+            max_seen = self._max_seen
+        if max_seen > self._persisted and self._save_hwm(max_seen):
+            self._persisted = max_seen
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.persist()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tracked": len(self._recent),
+                "high_water_mark": max(self._max_seen, self._floor or 0),
+                "persisted_high_water_mark": self._persisted,
+                "skipped_recent": self._skipped_recent,
+                "skipped_below_hwm": self._skipped_floor,
+            }
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None and not self._stop.is_set():
+                self._thread = threading.Thread(target=self._run, name="update-dedup", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        # Отметку читаем в фоне, чтобы первый запрос не ждал БД.
+        while self._floor is None and not self._stop.is_set():
+            try:
+                floor = self._load_hwm()
+            except Exception as e:
+                log.error(f"Не удалось загрузить отметку update_id: {e}", exc_info=True)
+                floor = None
+            if floor is not None:
+                with self._lock:
+                    self._floor = floor
+                    self._persisted = floor
+                log.info(f"Загружена отметка update_id: {floor}.")
+                break
+            self._stop.wait(self._persist_interval)
+        while not self._stop.wait(self._persist_interval):
+            try:
+                self.persist()
+            except Exception as e:
+                log.error(f"Не удалось сохранить отметку update_id: {e}", exc_info=True)
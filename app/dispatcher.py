@@ -0,0 +1,118 @@
+# app/dispatcher.py
+# Фоновая обработка апдейтов: вебхук сразу отвечает Telegram, а апдейты разбирает пул воркеров.
+import logging
+import queue
+import threading
+
+log = logging.getLogger(__name__)
+
+# Ключи апдейтов, внутри которых лежит объект с полем chat.
+_CHAT_CARRYING_KEYS = (
+    'message', 'edited_message', 'channel_post', 'edited_channel_post',
+    'chat_member', 'my_chat_member', 'chat_join_request',
+)
+
+
+def update_type_of(update):
+    """Возвращает тип апдейта ('message', 'chat_member', ...) по сырому словарю."""
+    for key in update:
+        if key != 'update_id':
+            return key
+    return None
+
+
+def chat_id_of(update):
+    """Достаёт ID чата из сырого словаря апдейта, не создавая объектов telebot."""
+    for key in _CHAT_CARRYING_KEYS:
+        payload = update.get(key)
+        if payload is not None:
+            chat = payload.get('chat')
+            return chat.get('id') if chat else None
+    return None
+
+
+class UpdateDispatcher:
+    """
+    Ограниченная очередь апдейтов и пул воркеров.
+    Апдейты одного чата всегда попадают к одному воркеру, поэтому правки не обгоняют оригиналы.
+    Лимит capacity общий на все очереди: один занятый чат может занять его целиком, пока остальные пусты.
+    """
+
+    def __init__(self, process, workers, capacity):
+        self._process = process
+        self._workers = max(workers, 1)
+        self._capacity = max(capacity, 1)
+        self._queues = [queue.Queue() for _ in range(self._workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self._pending = 0  # принятые, но ещё не обработанные апдейты во всех очередях
+        self._accepted = 0
+        self._rejected = 0
+        self._processed = 0
+        self._failed = 0
+
+    def submit(self, update):
+        """Ставит сырой апдейт в очередь. Возвращает False, если очередь переполнена."""
+        self._ensure_started()
+        key = chat_id_of(update)
+        if key is None:
+            key = update.get('update_id', 0)
+        with self._lock:
+            if self._pending >= self._capacity:
+                self._rejected += 1
+                return False
+            self._pending += 1
+            self._accepted += 1
+        self._queues[hash(key) % self._workers].put_nowait(update)
+        return True
+
+    def stop(self, timeout=30):
+        """Дожидается обработки уже принятых апдейтов и останавливает воркеры."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for q in self._queues[:len(threads)]:
+            q.put(None)
+        for thread in threads:
+            thread.join(timeout=timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self._workers,
+                "queued": self._pending,
+                "capacity": self._capacity,
+                "accepted": self._accepted,
+                "rejected": self._rejected,
+                "processed": self._processed,
+                "failed": self._failed,
+            }
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i, q in enumerate(self._queues):
+                thread = threading.Thread(target=self._run, args=(q,), name=f"update-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            log.info(f"Запущено {self._workers} воркеров обработки апдейтов.")
+
+    def _run(self, q):
+        while True:
+            update = q.get()
+            if update is None:
+                return
+            try:
+                self._process(update)
+                ok = True
+            except Exception as e:
+                log.error(f"Ошибка при обработке апдейта {update.get('update_id')}: {e}", exc_info=True)
+                ok = False
+            with self._lock:
+                self._pending -= 1
+                if ok:
+                    self._processed += 1
+                else:
+                    self._failed += 1
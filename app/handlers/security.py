@@ -1,15 +1,19 @@
 # app/handlers/security.py
 import os
-import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from ..database import queries
-from ..services import sync_editors_list
+from ..services import sync_editors_list, apply_editor_change
+from ..ratelimit import telegram_limiter
 
 log = logging.getLogger(__name__)
 
 # --- Основные переменные ---
 EDITORS_CHAT_ID = os.getenv("EDITORS_GROUP_ID")
 OTHER_CHAT_IDS = os.getenv("ALLOWED_CHAT_IDS", "").split(',')
+KICK_MAX_WORKERS = int(os.getenv("KICK_MAX_WORKERS", 8))  # сколько чатов обрабатывается параллельно
+# Сколько секунд запись "вышел из чата" считается достаточно свежей, чтобы не исключать из этого чата.
+KICK_TRUST_LEFT_MAX_AGE = float(os.getenv("KICK_TRUST_LEFT_MAX_AGE", 3600))
 
 if EDITORS_CHAT_ID:
     FULL_WHITELIST = [chat_id for chat_id in OTHER_CHAT_IDS if chat_id] + [EDITORS_CHAT_ID]
@@ -21,37 +25,94 @@ log.info(f"Загружен ID редакторского чата: {EDITORS_CHA
 log.info(f"Загружен список остальных чатов/каналов: {OTHER_CHAT_IDS}")
 log.info(f"Полный белый список для сканирования: {FULL_WHITELIST}")
 
+def _parse_chat_ids(chat_ids):
+    parsed = set()
+    for chat_id in chat_ids:
+        try:
+            parsed.add(int(chat_id))
+        except ValueError:
+            log.error(f"Некорректный ID чата в белом списке: '{chat_id}'.")
+    return frozenset(parsed)
+
+# Множество целочисленных ID для проверки за O(1) (в т.ч. в быстром фильтре вебхука).
+ALLOWED_CHAT_IDS = _parse_chat_ids(FULL_WHITELIST)
+
 
 # --- Основные функции ---
 
 def is_chat_allowed(chat_id):
     """Проверяет, находится ли ID чата в полном белом списке."""
-    return str(chat_id) in FULL_WHITELIST
+    return int(chat_id) in ALLOWED_CHAT_IDS
+
+_chat_titles = {}  # названия чатов меняются редко, лишний get_chat не нужен
+
+def _chat_title(bot, chat_id_str):
+    title = _chat_titles.get(chat_id_str)
+    if title is None:
+        try:
+            title = telegram_limiter.call(chat_id_str, bot.get_chat, chat_id_str).title or chat_id_str
+            _chat_titles[chat_id_str] = title
+        except Exception as e:
+            log.warning(f"Не удалось получить название чата {chat_id_str}: {e}")
+            title = chat_id_str
+    return title
+
+def _kick_from_chat(bot, chat_id_str, user_id):
+    """Исключает пользователя из одного чата (ban + unban). Возвращает название чата или None при ошибке."""
+    try:
+        telegram_limiter.call(chat_id_str, bot.ban_chat_member, chat_id_str, user_id)
+        telegram_limiter.call(chat_id_str, bot.unban_chat_member, chat_id_str, user_id, only_if_banned=True)
+    except Exception as e:
+        log.error(f"Не удалось исключить пользователя {user_id} из {chat_id_str}. Ошибка: {e}")
+        return None
+    return _chat_title(bot, chat_id_str)
+
+def _chats_to_kick_from(user_id):
+    """
+    Чаты из OTHER_CHAT_IDS, из которых нужно исключить пользователя. Пропускаются только те,
+    где по chat_membership он вышел не раньше KICK_TRUST_LEFT_MAX_AGE секунд назад; чаты без сведений
+    о нём и с более старой записью о выходе остаются в списке.
+
+    Ограничение: chat_membership может отставать от Telegram. При WEBHOOK_ASYNC=1 апдейты разных чатов
+    разбирают разные воркеры, и событие "снова вошёл в чат X" может ещё стоять в чужой очереди, когда
+    обрабатывается выход из редакторского чата; flush_member_log() его не видит. Поэтому старой записи
+    о выходе не доверяем: лишний ban/unban безвреден, а пропущенное исключение — нет.
+    """
+    all_chats = [chat_id_str for chat_id_str in OTHER_CHAT_IDS if chat_id_str]
+    queries.flush_member_log()  # в таблице должны быть и события, ещё лежащие в буфере
+    left_chat_ids = queries.get_user_left_chats(user_id, KICK_TRUST_LEFT_MAX_AGE)
+    if left_chat_ids is None:
+        log.warning(f"Состояние участия пользователя {user_id} недоступно, исключаю из всех чатов.")
+        return all_chats
+    left_chats = {str(chat_id) for chat_id in left_chat_ids}
+    target_chats = [chat_id_str for chat_id_str in all_chats if chat_id_str.strip() not in left_chats]
+    if len(target_chats) < len(all_chats):
+        log.info(f"Пользователь {user_id} уже не состоит в {len(all_chats) - len(target_chats)} чатах, они пропущены.")
+    return target_chats
 
 def handle_editor_exit(bot, update):
     """Логика, запускающаяся при выходе редактора из главного чата."""
     user_who_left = update.new_chat_member.user
     log.info(f"Зафиксирован выход редактора {user_who_left.id} из редакторского чата. ЗАПУСКАЮ ПРОЦЕДУРУ ИСКЛЮЧЕНИЯ.")
 
+    target_chats = _chats_to_kick_from(user_who_left.id)
     kicked_from, failed_to_kick = [], []
-    for chat_id_str in OTHER_CHAT_IDS:
-        if not chat_id_str: continue
-        try:
-            bot.ban_chat_member(chat_id_str, user_who_left.id)
-            bot.unban_chat_member(chat_id_str, user_who_left.id, only_if_banned=True)
-            chat_info = bot.get_chat(chat_id_str)
-            kicked_from.append(chat_info.title or chat_id_str)
-            time.sleep(1)
-        except Exception as e:
-            log.error(f"Не удалось исключить пользователя {user_who_left.id} из {chat_id_str}. Ошибка: {e}")
-            failed_to_kick.append(chat_id_str)
+    if target_chats:
+        # Чаты обрабатываются параллельно; темп задаёт только общий ограничитель запросов к Telegram.
+        with ThreadPoolExecutor(max_workers=min(KICK_MAX_WORKERS, len(target_chats))) as executor:
+            titles = list(executor.map(lambda chat_id_str: _kick_from_chat(bot, chat_id_str, user_who_left.id), target_chats))
+        for chat_id_str, title in zip(target_chats, titles):
+            if title is None:
+                failed_to_kick.append(chat_id_str)
+            else:
+                kicked_from.append(title)
 
     report_message = f"**СИСТЕМА БЕЗОПАСНОСТИ**\n\nПользователь **{user_who_left.first_name}** (@{user_who_left.username or 'N/A'}, ID: `{user_who_left.id}`) покинул редакторский чат.\n\nОн был автоматически исключен из всех пространств проекта."
     if kicked_from: report_message += "\n\n**Успешно исключен из:**\n- " + "\n- ".join(kicked_from)
     if failed_to_kick: report_message += f"\n\n**Не удалось исключить из (проверьте права бота):**\n- " + "\n- ".join(failed_to_kick)
 
     try:
-        bot.send_message(EDITORS_CHAT_ID, report_message, parse_mode="Markdown")
+        telegram_limiter.call(EDITORS_CHAT_ID, bot.send_message, EDITORS_CHAT_ID, report_message, parse_mode="Markdown")
     except Exception as e:
         log.error(f"Не удалось отправить отчет о безопасности. Ошибка: {e}")
 
@@ -70,6 +131,8 @@ def register_security_handlers(bot):
         if EDITORS_CHAT_ID:
             is_exit_event = update.new_chat_member.status in ['left', 'kicked']
             is_editors_chat = str(update.chat.id) == EDITORS_CHAT_ID
+            if is_editors_chat:
+                apply_editor_change(update)
             if is_exit_event and is_editors_chat:
                 handle_editor_exit(bot, update)
 
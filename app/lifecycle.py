@@ -0,0 +1,162 @@
+# app/lifecycle.py
+# Ленивый запуск фоновой части процесса и выбор ведущего процесса среди воркеров gunicorn.
+# Схему БД и периодические задачи выполняет только ведущий — тот, кто держит advisory-блокировку Postgres.
+import os
+import logging
+import threading
+from .database import queries
+from .scheduler import scheduler
+
+log = logging.getLogger(__name__)
+
+LEADER_LOCK_KEY = int(os.getenv("LEADER_LOCK_KEY", 4871001))            # общий для всех процессов бота
+LEADER_CHECK_INTERVAL = float(os.getenv("LEADER_CHECK_INTERVAL", 15))    # сек. между попытками/проверками
+
+
+class LeaderElector:
+    """
+    Пытается взять сессионную advisory-блокировку на отдельном соединении и держит её, пока соединение живо.
+    Блокировку может держать только один процесс; при обрыве соединения Postgres снимает её сам,
+    и её забирает другой процесс. on_elected/on_lost вызываются из фонового потока,
+    on_check — там же при каждой проверке, пока процесс остаётся ведущим.
+    """
+
+    def __init__(self, lock_key, check_interval, on_elected, on_lost, on_check=None):
+        self._lock_key = lock_key
+        self._check_interval = check_interval
+        self._on_elected = on_elected
+        self._on_lost = on_lost
+        self._on_check = on_check
+        self._conn = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._elections_won = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="leader-election", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Останавливает выборы и отпускает блокировку, чтобы её сразу мог взять другой процесс."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._conn is not None:
+            self._lose("процесс завершается")
+
+    def is_leader(self):
+        return self._conn is not None
+
+    def stats(self):
+        return {"leader": self.is_leader(), "elections_won": self._elections_won}
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._conn is None:
+                self._try_acquire()
+            elif not queries.connection_alive(self._conn):
+                self._lose("соединение с блокировкой потеряно")
+                continue
+            elif self._on_check is not None:
+                try:
+                    self._on_check()
+                except Exception as e:
+                    log.error(f"Ошибка в задачах ведущего процесса: {e}", exc_info=True)
+            self._stop.wait(self._check_interval)
+
+    def _try_acquire(self):
+        conn = queries.open_dedicated_connection()
+        if conn is None:
+            return
+        try:
+            acquired = queries.try_advisory_lock(conn, self._lock_key)
+        except Exception as e:
+            log.error(f"Не удалось запросить блокировку ведущего процесса: {e}")
+            acquired = False
+        if not acquired:
+            # Соединение не держим: ожидающим процессам оно не нужно, а занимало бы слот в Postgres.
+            conn.close()
+            return
+        self._conn = conn
+        self._elections_won += 1
+        log.info(f"Процесс {os.getpid()} стал ведущим.")
+        try:
+            self._on_elected()
+        except Exception as e:
+            log.error(f"Ошибка при запуске задач ведущего процесса: {e}", exc_info=True)
+
+    def _lose(self, reason):
+        conn, self._conn = self._conn, None
+        try:
+            conn.close()
+        except Exception:
+            pass
+        log.warning(f"Процесс {os.getpid()} больше не ведущий: {reason}.")
+        try:
+            self._on_lost()
+        except Exception as e:
+            log.error(f"Ошибка при остановке задач ведущего процесса: {e}", exc_info=True)
+
+
+_start_lock = threading.Lock()
+_started = False
+_schema_ready = False
+_leader_ready = False  # этот процесс, став ведущим, применил схему и запустил планировщик
+
+
+def _prepare_leader():
+    """
+    Применяет схему и только после этого запускает планировщик (обслуживание секций требует схемы).
+    Если init_db не удался (обрыв туннеля, таймаут блокировки), повтор — при следующей проверке ведущего:
+    остальные процессы схему не применяют, и без повтора /ready оставался бы 503 у всех.
+    """
+    global _schema_ready, _leader_ready
+    if _leader_ready:
+        return
+    if not queries.init_db():
+        log.warning(f"Схема БД не применена, повтор через {LEADER_CHECK_INTERVAL} с.")
+        return
+    _schema_ready = True
+    _leader_ready = True
+    scheduler.start()
+
+
+def _on_lost():
+    global _leader_ready
+    _leader_ready = False
+    scheduler.stop()
+
+
+elector = LeaderElector(LEADER_LOCK_KEY, LEADER_CHECK_INTERVAL,
+                        on_elected=_prepare_leader, on_lost=_on_lost, on_check=_prepare_leader)
+
+
+def ensure_started():
+    """
+    Запускает фоновую часть процесса при первом запросе, т.е. уже в воркере после fork.
+    Импорт модулей ничего не открывает: ни туннеля, ни соединений, ни потоков.
+    """
+    global _started
+    if _started:
+        return
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    elector.start()
+    log.info(f"Процесс {os.getpid()} запущен, участвует в выборе ведущего.")
+
+
+def readiness():
+    """(готов ли процесс принимать апдейты, подробности). Схема проверяется до первого успеха."""
+    global _schema_ready
+    if _started and not _schema_ready:
+        _schema_ready = queries.schema_exists()
+    details = {"started": _started, "schema_ready": _schema_ready, **elector.stats()}
+    return _started and _schema_ready, details
+
+
+def stop():
+    elector.stop()
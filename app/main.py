@@ -1,10 +1,8 @@
 # app/main.py
 from .bot import app
-from .database.queries import init_db
 import os
 
-# Инициализируем БД при старте приложения
-init_db()
+# Схема БД применяется не здесь, а ведущим процессом после запуска (см. app/lifecycle.py).
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
@@ -0,0 +1,152 @@
+# app/metrics.py
+# Лёгкие метрики в формате Prometheus: счётчики, гистограммы и сборщики готовой статистики.
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+# Границы корзин гистограмм задержек, в секундах.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_collectors = []
+_registry_lock = threading.Lock()
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    """Монотонный счётчик с метками."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами; observe() — один bisect и пара сложений под блокировкой."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [counts по корзинам (+Inf последней), сумма]
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        labelnames = self.labelnames + ("le",)
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(labelnames, labels + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+def register_collector(collect):
+    """
+    Регистрирует функцию, которая при каждом запросе /metrics возвращает готовые значения:
+    итерируемое из (имя, описание, тип, {метка: значение}, число).
+    """
+    with _registry_lock:
+        _collectors.append(collect)
+
+
+def render():
+    """Собирает все метрики процесса в текстовый формат Prometheus."""
+    with _registry_lock:
+        metrics, collectors = list(_registry), list(_collectors)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    # Формат требует, чтобы все значения одной метрики шли подряд, а сборщики отдают их вперемешку
+    # (например, по три метрики на каждый буфер), поэтому значения сначала группируются по имени.
+    families = {}  # имя -> (описание, тип, строки); dict сохраняет порядок первого появления
+    for collect in collectors:
+        for name, documentation, metric_type, labels, value in collect():
+            family = families.get(name)
+            if family is None:
+                family = families[name] = (documentation, metric_type, [])
+            family[2].append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}")
+    for name, (documentation, metric_type, samples) in families.items():
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+# --- Метрики горячего пути ---
+
+WEBHOOK_STAGE_SECONDS = Histogram(
+    "hjr_webhook_stage_seconds", "Время этапов обработки апдейта.", ("stage",))
+DB_QUERY_SECONDS = Histogram(
+    "hjr_db_query_seconds", "Время вызовов queries.*.", ("query",))
+UPDATES_TOTAL = Counter(
+    "hjr_updates_total", "Полученные апдейты по типу и чату.", ("update_type", "chat_id"))
+SSH_TUNNEL_STARTS = Counter(
+    "hjr_ssh_tunnel_starts_total", "Запуски (и перезапуски) SSH-туннеля.", ("result",))
+DB_CONNECT_FAILURES = Counter(
+    "hjr_db_connect_failures_total", "Неудачные попытки открыть соединение с БД.")
+
+
+def timed_query(func):
+    """Декоратор для функций queries.*: пишет длительность вызова в hjr_db_query_seconds."""
+    name = func.__name__.lstrip('_')
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with DB_QUERY_SECONDS.time(name):
+            return func(*args, **kwargs)
+    return wrapper
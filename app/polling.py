@@ -0,0 +1,130 @@
+# app/polling.py
+# Режим догонки после простоя: апдейты забираются через getUpdates пачками, а не по одному запросу на вебхук.
+# Запуск: python -m app.polling
+# Если задан WEBHOOK_URL, вебхук возвращается, как только накопленная очередь Telegram разобрана; без него — обычный long polling.
+import os
+import json
+import time
+import logging
+from telebot import apihelper
+from .bot import bot, SECRET, process_raw_update, prefilter_update, deduplicator, HANDLED_UPDATE_TYPES, UPDATE_HWM_KEY
+from .database import queries
+from . import lifecycle
+
+log = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+POLLING_BATCH_SIZE = min(int(os.getenv("POLLING_BATCH_SIZE", 100)), 100)  # больше 100 за раз Telegram не отдаёт
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", 25))                    # сек. long polling без WEBHOOK_URL
+POLLING_ERROR_DELAY = float(os.getenv("POLLING_ERROR_DELAY", 5))
+POLLING_HTTP_TIMEOUT = float(os.getenv("POLLING_HTTP_TIMEOUT", 10))        # сек. HTTP сверх времени long polling
+
+POLLING_OFFSET_KEY = "polling_offset"
+# chat_member Telegram присылает, только если он явно перечислен в allowed_updates.
+ALLOWED_UPDATES = sorted(HANDLED_UPDATE_TYPES)
+
+
+def process_batch(raw_updates):
+    """
+    Прогоняет пачку сырых апдейтов через отсев повторов, быстрый фильтр и обработчики.
+    Всё, что обработчики логируют, пишется одной транзакцией вместе с новым смещением и отметкой update_id:
+    отметка не может оказаться сохранённой раньше строк, иначе после падения повтор пачки был бы отброшен.
+    Возвращает (следующее смещение, число обработанных апдейтов).
+    """
+    next_offset = raw_updates[-1]['update_id'] + 1
+    handled = 0
+    accepted = []
+    with queries.batch() as write_batch:
+        for update_json in raw_updates:
+            update_id = update_json.get('update_id')
+            if update_id is not None:
+                if deduplicator.is_duplicate(update_id):
+                    continue
+                accepted.append(update_id)
+            if prefilter_update(update_json):
+                continue
+            try:
+                process_raw_update(update_json)
+                handled += 1
+            except Exception as e:
+                log.error(f"Ошибка при обработке апдейта {update_id}: {e}", exc_info=True)
+        write_batch.set_state(POLLING_OFFSET_KEY, next_offset)
+        if accepted:
+            write_batch.set_state(UPDATE_HWM_KEY, max(accepted), monotonic=True)
+    if write_batch.committed:
+        # Фоновое сохранение отметки в deduplicator теперь не опередит транзакцию пачки.
+        for update_id in accepted:
+            deduplicator.accept(update_id)
+    else:
+        log.warning(f"Пачка до смещения {next_offset} не записана в БД одной транзакцией, строки ушли в spool.")
+    return next_offset, handled
+
+
+def get_updates(offset, long_polling_timeout, limit=POLLING_BATCH_SIZE):
+    """
+    getUpdates сырыми словарями. apihelper.get_updates не передаёт нулевые таймауты, и Telegram ждёт
+    по умолчанию, поэтому запрос собирается напрямую. В параметрах apihelper 'timeout' — таймаут HTTP,
+    а 'long_polling_timeout' уходит в Telegram как его timeout; при 0 Telegram отвечает сразу.
+    """
+    params = {
+        'limit': limit,
+        'allowed_updates': json.dumps(ALLOWED_UPDATES),
+        'timeout': long_polling_timeout + POLLING_HTTP_TIMEOUT,
+        'long_polling_timeout': long_polling_timeout,
+    }
+    if offset:
+        params['offset'] = offset
+    return apihelper._make_request(bot.token, 'getUpdates', params=params)
+
+
+def run():
+    lifecycle.ensure_started()
+    drain = bool(WEBHOOK_URL)
+    long_polling_timeout = 0 if drain else POLLING_TIMEOUT
+
+    bot.delete_webhook()
+    log.info("Вебхук снят, апдейты забираются через getUpdates.")
+    # Telegram сам помнит подтверждённые апдейты; сохранённое смещение нужно, чтобы после падения
+    # не обрабатывать заново пачку, которую Telegram ещё не считает подтверждённой.
+    offset = queries.get_bot_state(POLLING_OFFSET_KEY, max_age_days=7) or None
+
+    started, received, handled = time.monotonic(), 0, 0
+    while True:
+        try:
+            # Сырые словари, а не объекты telebot: быстрый фильтр отсеивает лишнее до de_json.
+            raw_updates = get_updates(offset, long_polling_timeout)
+        except Exception as e:
+            log.error(f"Ошибка getUpdates: {e}. Повтор через {POLLING_ERROR_DELAY} с.")
+            time.sleep(POLLING_ERROR_DELAY)
+            continue
+        if not raw_updates:
+            if drain:
+                break
+            continue
+        offset, batch_handled = process_batch(raw_updates)
+        received += len(raw_updates)
+        handled += batch_handled
+        log.info(f"Пачка из {len(raw_updates)} апдейтов обработана (в обработчики: {batch_handled}), смещение {offset}.")
+        # Неполная пачка — накопленное разобрано. На живом боте новые апдейты приходят постоянно,
+        # и пустого ответа можно не дождаться; всё, что не подтверждено, Telegram доставит на вебхук.
+        if drain and len(raw_updates) < POLLING_BATCH_SIZE:
+            break
+
+    if offset:
+        # Telegram подтверждает апдейты только следующим getUpdates со смещением; без этого
+        # последняя пачка пришла бы повторно на вебхук. Полученное этим вызовом не подтверждено и придёт туда же.
+        try:
+            get_updates(offset, 0, limit=1)
+        except Exception as e:
+            log.warning(f"Не удалось подтвердить апдейты до смещения {offset}: {e}. Повторы отсеет deduplicator.")
+    elapsed = time.monotonic() - started
+    log.info(f"Накопленные апдейты разобраны: получено {received}, обработано {handled} за {elapsed:.1f} с.")
+    bot.set_webhook(url=WEBHOOK_URL, secret_token=SECRET, allowed_updates=ALLOWED_UPDATES)
+    log.info(f"Вебхук возвращён: {WEBHOOK_URL}.")
+
+
+if __name__ == '__main__':
+    try:
+        run()
+    except KeyboardInterrupt:
+        log.info("Режим getUpdates остановлен.")
@@ -0,0 +1,108 @@
+# app/ratelimit.py
+# Ограничение частоты вызовов Telegram Bot API: общий лимит бота и лимит на каждый чат.
+import os
+import time
+import random
+import logging
+import threading
+from telebot.apihelper import ApiTelegramException
+
+log = logging.getLogger(__name__)
+
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 30))      # вызовов в секунду на весь бот
+TELEGRAM_PER_CHAT_RATE = float(os.getenv("TELEGRAM_PER_CHAT_RATE", 1))    # вызовов в секунду на один чат
+TELEGRAM_PER_CHAT_BURST = float(os.getenv("TELEGRAM_PER_CHAT_BURST", 3))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", 4))
+TELEGRAM_RETRY_BASE_DELAY = float(os.getenv("TELEGRAM_RETRY_BASE_DELAY", 0.5))
+
+
+class TokenBucket:
+    """Классический token bucket. acquire() резервирует токен и спит ровно столько, сколько нужно."""
+
+    def __init__(self, rate, capacity):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            delay = -self._tokens / self._rate if self._tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        """
+        Запрещает выдачу токенов на seconds секунд (ответ 429 с retry_after).
+        Паузы не складываются: несколько 429 подряд дают паузу по самому длинному retry_after.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._updated) * self._rate, -seconds * self._rate)
+            self._updated = now
+
+
+class TelegramRateLimiter:
+    """Общий bucket на бота плюс отдельный bucket на каждый чат; повторы с backoff и учётом retry_after."""
+
+    def __init__(self, global_rate, per_chat_rate, per_chat_burst, max_retries, retry_base_delay):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._per_chat_rate = per_chat_rate
+        self._per_chat_burst = per_chat_burst
+        self._max_retries = max_retries
+        self._retry_base_delay = retry_base_delay
+        self._chats = {}
+        self._lock = threading.Lock()
+
+    def call(self, chat_id, method, *args, **kwargs):
+        """Вызывает method(*args, **kwargs) с соблюдением лимитов. Постоянные ошибки (400/403) не повторяются."""
+        bucket = self._chat_bucket(chat_id)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            self._global.acquire()
+            try:
+                return method(*args, **kwargs)
+            except ApiTelegramException as e:
+                if e.error_code != 429 and e.error_code < 500:
+                    raise
+                if attempt >= self._max_retries:
+                    raise
+                if e.error_code == 429:
+                    retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 1)
+                    log.warning(f"Telegram ограничил частоту запросов для {chat_id}: повтор через {retry_after} с.")
+                    # Flood wait часто действует на весь бот: ждут и остальные чаты, а не только этот.
+                    bucket.pause(retry_after)
+                    self._global.pause(retry_after)
+                else:
+                    self._backoff(attempt)
+            except Exception:
+                if attempt >= self._max_retries:
+                    raise
+                self._backoff(attempt)
+            attempt += 1
+
+    def _backoff(self, attempt):
+        time.sleep(self._retry_base_delay * (2 ** attempt) * (0.5 + random.random()))
+
+    def _chat_bucket(self, chat_id):
+        key = str(chat_id)
+        with self._lock:
+            bucket = self._chats.get(key)
+            if bucket is None:
+                bucket = self._chats[key] = TokenBucket(self._per_chat_rate, self._per_chat_burst)
+            return bucket
+
+
+telegram_limiter = TelegramRateLimiter(
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_PER_CHAT_RATE,
+    TELEGRAM_PER_CHAT_BURST,
+    max_retries=TELEGRAM_MAX_RETRIES,
+    retry_base_delay=TELEGRAM_RETRY_BASE_DELAY,
+)
@@ -0,0 +1,71 @@
+# app/scheduler.py
+# Простой планировщик периодических фоновых задач (синхронизация редакторов и т.п.).
+import time
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class PeriodicScheduler:
+    """
+    Запускает зарегистрированные задачи в одном фоновом потоке через заданные интервалы.
+    У каждого запуска свой флаг остановки: поток, не успевший завершиться после stop() (долгая задача),
+    не оживает при следующем start() и не выполняет задачи параллельно с новым потоком.
+    """
+
+    def __init__(self):
+        self._jobs = []  # [name, interval, func, next_run]
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stop = None  # threading.Event текущего потока
+
+    def add_job(self, name, interval, func, initial_delay=0):
+        with self._cond:
+            self._jobs.append([name, interval, func, time.monotonic() + initial_delay])
+            self._cond.notify_all()
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,), name="scheduler", daemon=True)
+            self._thread.start()
+        log.info("Планировщик фоновых задач запущен.")
+
+    def stop(self, timeout=5):
+        with self._cond:
+            if self._stop is not None:
+                self._stop.set()
+            self._cond.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=timeout)
+            if thread.is_alive():
+                log.warning("Фоновая задача ещё выполняется; поток планировщика завершится после неё.")
+
+    def _run(self, stop):
+        while True:
+            with self._cond:
+                while not stop.is_set():
+                    now = time.monotonic()
+                    due = [job for job in self._jobs if job[3] <= now]
+                    if due:
+                        break
+                    next_run = min((job[3] for job in self._jobs), default=now + 60)
+                    self._cond.wait(next_run - now)
+                if stop.is_set():
+                    return
+            for job in due:
+                if stop.is_set():
+                    return
+                name, interval, func, _ = job
+                try:
+                    func()
+                except Exception as e:
+                    log.error(f"Фоновая задача '{name}' завершилась с ошибкой: {e}", exc_info=True)
+                job[3] = time.monotonic() + interval
+
+
+scheduler = PeriodicScheduler()
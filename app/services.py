@@ -1,16 +1,58 @@
 # app/services.py
+import os
 import logging
 from .database import queries
+from .scheduler import scheduler
 log = logging.getLogger(__name__)
 
+EDITORS_SYNC_INTERVAL = float(os.getenv("EDITORS_SYNC_INTERVAL", 3600))     # сек. между плановыми синхронизациями
+EDITORS_SYNC_INITIAL_DELAY = float(os.getenv("EDITORS_SYNC_INITIAL_DELAY", 3))
+MESSAGE_LOG_MAINTENANCE_INTERVAL = float(os.getenv("MESSAGE_LOG_MAINTENANCE_INTERVAL", 6 * 3600))
+MESSAGE_LOG_MAINTENANCE_INITIAL_DELAY = float(os.getenv("MESSAGE_LOG_MAINTENANCE_INITIAL_DELAY", 3))
+
+ADMIN_STATUSES = ('creator', 'administrator')
+
+def editor_role(member):
+    """Определяет роль редактора по кастомному титулу администратора."""
+    custom_title = getattr(member, 'custom_title', None)
+    return 'executor' if custom_title and 'исполнитель' in custom_title.lower() else 'editor'
+
 def sync_editors_list(bot):
     from .handlers.security import EDITORS_CHAT_ID
     if not EDITORS_CHAT_ID:
         return 0, "EDITORS_GROUP_ID не задан."
     try:
         admins = bot.get_chat_administrators(EDITORS_CHAT_ID)
-        editors = [{"user": a.user, "role": 'executor' if a.custom_title and 'исполнитель' in a.custom_title.lower() else 'editor'} for a in admins if not a.user.is_bot]
+        editors = [{"user": a.user, "role": editor_role(a)} for a in admins if not a.user.is_bot]
         queries.update_editor_list(editors)
         return len(editors), None
     except Exception as e:
-        return 0, str(e)
\ No newline at end of file
+        return 0, str(e)
+
+def apply_editor_change(update):
+    """Обновляет таблицу editors по одному событию chat_member из редакторского чата, без полной синхронизации."""
+    member = update.new_chat_member
+    if member.user.is_bot:
+        return
+    if member.status in ADMIN_STATUSES:
+        queries.upsert_editor(member.user, editor_role(member))
+    elif update.old_chat_member and update.old_chat_member.status in ADMIN_STATUSES:
+        queries.remove_editor(member.user.id)
+
+def schedule_editor_sync(bot):
+    """
+    Ставит периодическую синхронизацию списка редакторов в фоновый планировщик.
+    Сам планировщик запускается только в ведущем процессе (см. app/lifecycle.py).
+    """
+    def job():
+        log.info("Плановая синхронизация списка редакторов...")
+        count, error = sync_editors_list(bot)
+        if error:
+            log.error(f"Плановая синхронизация редакторов провалилась: {error}")
+
+    scheduler.add_job("editors_sync", EDITORS_SYNC_INTERVAL, job, initial_delay=EDITORS_SYNC_INITIAL_DELAY)
+
+def schedule_message_log_maintenance():
+    """Ставит обслуживание секций message_log (создание будущих, архивация старых) в фоновый планировщик."""
+    scheduler.add_job("message_log_maintenance", MESSAGE_LOG_MAINTENANCE_INTERVAL,
+                      queries.maintain_message_log_partitions, initial_delay=MESSAGE_LOG_MAINTENANCE_INITIAL_DELAY)
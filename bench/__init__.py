@@ -0,0 +1,2 @@
+# bench/__init__.py
+# Бенчмарки горячего пути вебхука (см. bench/replay.py).
@@ -0,0 +1,28 @@
+# bench/environment.py
+# Окружение для бенчмарков: вымышленные чаты и настройки, которые нужно задать ДО импорта app.bot.
+import os
+
+EDITORS_CHAT_ID = -1001000000000
+ALLOWED_GROUP_IDS = [-1001000000001, -1001000000002, -1001000000003, -1001000000004]
+ALLOWED_CHANNEL_IDS = [-1001000000100]
+FOREIGN_CHAT_IDS = [-1002000000001, -1002000000002, -1002000000003]  # чаты, которые бот не отслеживает
+
+BENCH_ENV = {
+    "HJRSCANNER_TELEGRAM_TOKEN": "123456:BENCHMARK-TOKEN",
+    "WEBHOOK_SECRET": "bench-secret",
+    "EDITORS_GROUP_ID": str(EDITORS_CHAT_ID),
+    "ALLOWED_CHAT_IDS": ",".join(str(chat_id) for chat_id in ALLOWED_GROUP_IDS + ALLOWED_CHANNEL_IDS),
+    # Плановая синхронизация редакторов в бенчмарке не нужна.
+    "EDITORS_SYNC_INITIAL_DELAY": "1000000000",
+    # Меряем свой код, а не лимиты Telegram: фейковый API отвечает мгновенно.
+    "TELEGRAM_GLOBAL_RATE": "1000000",
+    "TELEGRAM_PER_CHAT_RATE": "1000000",
+    "TELEGRAM_PER_CHAT_BURST": "1000000",
+    "LOG_LEVEL": "WARNING",
+}
+
+
+def configure_environment():
+    """Проставляет переменные окружения бенчмарка, не перетирая заданные явно."""
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
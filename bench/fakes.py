@@ -0,0 +1,177 @@
+# bench/fakes.py
+# Подмены внешнего мира для бенчмарков: БД в памяти (или реальный Postgres со счётчиками) и Telegram API.
+import os
+import json
+import time
+import threading
+
+
+class Counters:
+    """Потокобезопасные счётчики обращений к БД и к Telegram."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+
+counters = Counters()
+
+
+# --- БД в памяти ---
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = -1
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def execute(self, query, vars=None):
+        counters.incr("db_round_trips")
+        self.connection._in_transaction = True
+        self._rows = []
+        self.rowcount = 0
+
+    def mogrify(self, query, vars=None):
+        return repr(vars).encode()
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def fetchmany(self, size=None):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Минимальная имитация соединения psycopg2: считает запросы и коммиты, данных не хранит."""
+
+    encoding = 'UTF8'
+
+    def __init__(self):
+        self.closed = 0
+        self._in_transaction = False
+        counters.incr("db_connections_opened")
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self)
+
+    def commit(self):
+        counters.incr("db_round_trips")
+        counters.incr("db_commits")
+        self._in_transaction = False
+
+    def rollback(self):
+        if self._in_transaction:
+            counters.incr("db_round_trips")
+        self._in_transaction = False
+
+    def get_transaction_status(self):
+        # Значения совпадают с psycopg2.extensions.TRANSACTION_STATUS_IDLE / _INTRANS.
+        return 2 if self._in_transaction else 0
+
+    def close(self):
+        self.closed = 1
+
+
+def install_fake_db():
+    """Подключает пул app.database.queries к БД в памяти (SSH-туннель не используется)."""
+    from app.database import queries
+    queries.use_connection_factory(FakeConnection)
+
+
+def install_counting_postgres():
+    """Подключает пул к локальному Postgres напрямую (DB_HOST/DB_PORT/...), считая запросы и коммиты."""
+    import psycopg2
+    import psycopg2.extensions
+    from app.database import queries
+
+    class CountingCursor(psycopg2.extensions.cursor):
+        def execute(self, query, vars=None):
+            counters.incr("db_round_trips")
+            return super().execute(query, vars)
+
+    class CountingConnection(psycopg2.extensions.connection):
+        def cursor(self, *args, **kwargs):
+            kwargs.setdefault('cursor_factory', CountingCursor)
+            return super().cursor(*args, **kwargs)
+
+        def commit(self):
+            counters.incr("db_round_trips")
+            counters.incr("db_commits")
+            return super().commit()
+
+    def connect():
+        counters.incr("db_connections_opened")
+        return psycopg2.connect(
+            host=os.getenv("DB_HOST", "127.0.0.1"),
+            port=int(os.getenv("DB_PORT", 5432)),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            dbname=os.getenv("DB_NAME"),
+            connection_factory=CountingConnection,
+        )
+
+    queries.use_connection_factory(connect)
+
+
+# --- Telegram API ---
+
+class _FakeResponse:
+    status_code = 200
+    reason = 'OK'
+
+    def __init__(self, result):
+        self._payload = {"ok": True, "result": result}
+        self.text = json.dumps(self._payload)
+
+    def json(self):
+        return self._payload
+
+
+def _fake_telegram_sender(method, url, params=None, files=None, **kwargs):
+    api_method = url.rsplit('/', 1)[-1]
+    counters.incr("telegram_calls")
+    params = params or {}
+    chat_id = params.get('chat_id', 0)
+    if api_method == 'getChat':
+        result = {"id": int(chat_id), "type": "supergroup", "title": f"Chat {chat_id}"}
+    elif api_method == 'sendMessage':
+        result = {"message_id": 1, "date": int(time.time()), "text": params.get('text', ''),
+                  "chat": {"id": int(chat_id), "type": "supergroup", "title": f"Chat {chat_id}"}}
+    elif api_method == 'getChatAdministrators':
+        result = []
+    elif api_method == 'getUpdates':
+        result = []
+    else:
+        result = True
+    return _FakeResponse(result)
+
+
+def install_fake_telegram():
+    """Перехватывает все запросы telebot к Bot API и отвечает мгновенно."""
+    from telebot import apihelper
+    apihelper.CUSTOM_REQUEST_SENDER = _fake_telegram_sender
@@ -0,0 +1,28 @@
+# bench/gunicorn_app.py
+# Точка входа для прогона бенчмарка через настоящий gunicorn:
+#     gunicorn bench.gunicorn_app:app
+# Внешний мир подменяется так же, как в режиме test client (см. bench/fakes.py).
+import os
+from flask import jsonify
+
+from .environment import configure_environment
+
+configure_environment()
+
+from .fakes import counters, install_fake_db, install_counting_postgres, install_fake_telegram
+
+install_fake_telegram()
+if os.getenv("BENCH_DB", "fake") == "postgres":
+    install_counting_postgres()
+else:
+    install_fake_db()
+
+from app.main import app  # noqa: E402
+
+
+@app.route('/bench/counters', methods=['GET'])
+def bench_counters():
+    """Счётчики обращений к БД и Telegram внутри этого воркера."""
+    from app.database import queries
+    queries.flush_buffers()
+    return jsonify(counters.snapshot()), 200
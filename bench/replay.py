@@ -0,0 +1,309 @@
+# bench/replay.py
+"""
+Бенчмарк горячего пути: прогоняет синтетический поток апдейтов через webhook().
+
+    python -m bench.replay --updates 5000                       # Flask test client, БД в памяти
+    python -m bench.replay --db postgres                         # локальный Postgres (DB_HOST, DB_USER, ...)
+    python -m bench.replay --async                               # режим WEBHOOK_ASYNC=1
+    python -m bench.replay --mode gunicorn --workers 1 --concurrency 8
+    python -m bench.replay --save-baseline client-fake           # сохранить bench/baselines/client-fake.json
+    python -m bench.replay --compare client-fake                 # сравнить с базовой линией (код выхода 1 при регрессии)
+
+SSH-туннель не используется: БД либо подменяется в памяти, либо подключается напрямую.
+Telegram API всегда подменяется фейком, отвечающим мгновенно.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import tracemalloc
+import subprocess
+import http.client
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from .environment import configure_environment
+from .updates import UpdateStream
+
+WEBHOOK_PATH = '/telegram/hjr-scanner'
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Метрика -> True, если больше значит лучше.
+COMPARED_METRICS = {
+    "updates_per_sec": True,
+    "latency_ms.p50": False,
+    "latency_ms.p95": False,
+    "latency_ms.p99": False,
+    "db_round_trips_per_update": False,
+    "db_commits_per_update": False,
+    "telegram_calls_per_update": False,
+    "alloc_peak_kib_per_update": False,
+}
+# Метрики, которые не зависят от машины: их можно сравнивать с базовой линией из репозитория.
+COUNT_METRICS = ("db_round_trips_per_update", "db_commits_per_update", "telegram_calls_per_update")
+
+
+def _headers():
+    return {
+        'Content-Type': 'application/json',
+        'X-Telegram-Bot-Api-Secret-Token': os.environ['WEBHOOK_SECRET'],
+    }
+
+
+def _percentiles(latencies):
+    ordered = sorted(latencies)
+    if not ordered:
+        return {}
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": round(ordered[-1] * 1000, 3)}
+
+
+def _per_update(snapshot, name, count):
+    return round(snapshot.get(name, 0) / count, 4) if count else None
+
+
+def _wait_until_drained(bot_module, timeout=120):
+    """В асинхронном режиме ждём, пока воркеры разберут очередь, затем сбрасываем буферы записи."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = bot_module.dispatcher.stats()
+        if stats["processed"] + stats["failed"] >= stats["accepted"]:
+            break
+        time.sleep(0.005)
+    bot_module.queries.flush_buffers()
+
+
+def run_client(bodies, args):
+    from .fakes import counters, install_fake_db, install_counting_postgres, install_fake_telegram
+
+    install_fake_telegram()
+    if args.db == 'postgres':
+        install_counting_postgres()
+    else:
+        install_fake_db()
+    from app import bot as bot_module
+    logging.getLogger().setLevel(logging.WARNING)
+
+    client = bot_module.app.test_client()
+    headers = _headers()
+
+    for body in bodies[:args.warmup]:
+        client.post(WEBHOOK_PATH, data=body, headers=headers)
+    _wait_until_drained(bot_module)
+    measured = bodies[args.warmup:]
+
+    counters.reset()
+    statuses = Counter()
+    latencies = []
+    started = time.perf_counter()
+    for body in measured:
+        t0 = time.perf_counter()
+        response = client.post(WEBHOOK_PATH, data=body, headers=headers)
+        latencies.append(time.perf_counter() - t0)
+        statuses[response.status_code] += 1
+    _wait_until_drained(bot_module)
+    elapsed = time.perf_counter() - started
+    snapshot = counters.snapshot()
+
+    # Отдельный проход под tracemalloc, чтобы трассировка не искажала задержки.
+    sample = measured[:args.alloc_sample]
+    tracemalloc.start()
+    peaks = []
+    blocks_before = sys.getallocatedblocks()
+    for body in sample:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        client.post(WEBHOOK_PATH, data=body, headers=headers)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - base)
+    _wait_until_drained(bot_module)
+    retained_blocks = sys.getallocatedblocks() - blocks_before
+    tracemalloc.stop()
+
+    return {
+        "updates": len(measured),
+        "elapsed_sec": round(elapsed, 4),
+        "updates_per_sec": round(len(measured) / elapsed, 1) if elapsed else None,
+        "latency_ms": _percentiles(latencies),
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "db_round_trips_per_update": _per_update(snapshot, "db_round_trips", len(measured)),
+        "db_commits_per_update": _per_update(snapshot, "db_commits", len(measured)),
+        "db_connections_opened": snapshot.get("db_connections_opened", 0),
+        "telegram_calls_per_update": _per_update(snapshot, "telegram_calls", len(measured)),
+        "alloc_peak_kib_per_update": round(sum(peaks) / len(peaks) / 1024, 2) if peaks else None,
+        "retained_blocks_per_update": round(retained_blocks / len(sample), 2) if sample else None,
+    }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _get_json(port, path):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def run_gunicorn(bodies, args):
+    port = _free_port()
+    env = dict(os.environ)
+    env["BENCH_DB"] = args.db
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+         '--workers', str(args.workers), '--threads', str(args.threads),
+         '--log-level', 'warning', 'bench.gunicorn_app:app'],
+        cwd=REPO_ROOT, env=env,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                if _get_json(port, '/health')[0] == 200:
+                    break
+            except OSError:
+                pass
+            if time.monotonic() > deadline or proc.poll() is not None:
+                raise RuntimeError("gunicorn не поднялся за 30 секунд.")
+            time.sleep(0.1)
+
+        headers = _headers()
+        measured = bodies[args.warmup:]
+        chunks = [measured[i::args.concurrency] for i in range(args.concurrency)]
+
+        def send(chunk):
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            result = []
+            try:
+                for body in chunk:
+                    t0 = time.perf_counter()
+                    conn.request('POST', WEBHOOK_PATH, body=body.encode('utf-8'), headers=headers)
+                    response = conn.getresponse()
+                    response.read()
+                    result.append((time.perf_counter() - t0, response.status))
+            finally:
+                conn.close()
+            return result
+
+        send(bodies[:args.warmup])
+        counters_before = json.loads(_get_json(port, '/bench/counters')[1]) if args.workers == 1 else {}
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = [item for chunk_result in executor.map(send, chunks) for item in chunk_result]
+        counters_after = json.loads(_get_json(port, '/bench/counters')[1]) if args.workers == 1 else {}
+        elapsed = time.perf_counter() - started
+    finally:
+        proc.terminate()
+        proc.wait(timeout=60)
+
+    snapshot = {key: counters_after.get(key, 0) - counters_before.get(key, 0) for key in counters_after}
+    count = len(results)
+    result = {
+        "updates": count,
+        "elapsed_sec": round(elapsed, 4),
+        "updates_per_sec": round(count / elapsed, 1) if elapsed else None,
+        "latency_ms": _percentiles([latency for latency, _ in results]),
+        "statuses": {str(code): n for code, n in sorted(Counter(status for _, status in results).items())},
+    }
+    if args.workers == 1:
+        # Счётчики доступны только для единственного воркера: каждый воркер считает своё.
+        result["db_round_trips_per_update"] = _per_update(snapshot, "db_round_trips", count)
+        result["db_commits_per_update"] = _per_update(snapshot, "db_commits", count)
+        result["telegram_calls_per_update"] = _per_update(snapshot, "telegram_calls", count)
+    return result
+
+
+def _metric(result, dotted):
+    value = result
+    for part in dotted.split('.'):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(result, baseline, tolerance, counts_only=False):
+    """Печатает сравнение с базовой линией и возвращает список регрессировавших метрик."""
+    regressions = []
+    for name, higher_is_better in COMPARED_METRICS.items():
+        if counts_only and name not in COUNT_METRICS:
+            continue
+        new, old = _metric(result, name), _metric(baseline["result"], name)
+        if new is None or old is None or old == 0:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        mark = "РЕГРЕССИЯ" if worse > tolerance else "ok"
+        print(f"{name:32} {old:>12} -> {new:>12}  ({change:+.1%})  {mark}")
+        if worse > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк вебхука HJR-Scanner на синтетическом потоке апдейтов.")
+    parser.add_argument('--mode', choices=['client', 'gunicorn'], default='client')
+    parser.add_argument('--db', choices=['fake', 'postgres'], default='fake')
+    parser.add_argument('--async', dest='async_mode', action='store_true', help="включить WEBHOOK_ASYNC=1")
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--alloc-sample', type=int, default=500, help="сколько апдейтов прогнать под tracemalloc")
+    parser.add_argument('--workers', type=int, default=1, help="воркеры gunicorn")
+    parser.add_argument('--threads', type=int, default=1, help="потоки на воркер gunicorn")
+    parser.add_argument('--concurrency', type=int, default=4, help="параллельные клиенты в режиме gunicorn")
+    parser.add_argument('--save-baseline', metavar='NAME')
+    parser.add_argument('--compare', metavar='NAME')
+    parser.add_argument('--tolerance', type=float, default=0.15, help="допустимое ухудшение (доля)")
+    parser.add_argument('--counts-only', action='store_true',
+                        help="сравнивать только число запросов к БД и Telegram на апдейт (не зависит от машины)")
+    args = parser.parse_args(argv)
+
+    configure_environment()
+    if args.async_mode:
+        os.environ["WEBHOOK_ASYNC"] = "1"
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+    updates = UpdateStream(seed=args.seed).generate(args.warmup + args.updates)
+    bodies = [json.dumps(update, ensure_ascii=False) for update in updates]
+    result = run_client(bodies, args) if args.mode == 'client' else run_gunicorn(bodies, args)
+
+    meta = {
+        "mode": args.mode, "db": args.db, "async": args.async_mode, "updates": args.updates, "seed": args.seed,
+        "workers": args.workers, "threads": args.threads, "concurrency": args.concurrency,
+        "python": platform.python_version(), "created_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    print(json.dumps({"meta": meta, "result": result}, ensure_ascii=False, indent=2))
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"meta": meta, "result": result}, f, ensure_ascii=False, indent=2)
+        print(f"Базовая линия сохранена: {path}")
+
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json"), encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance, counts_only=args.counts_only)
+        if regressions:
+            print(f"Регрессии: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+# bench/updates.py
+# Генератор синтетического потока апдейтов Telegram в том виде, в каком они приходят на вебхук.
+import random
+import time
+
+from .environment import EDITORS_CHAT_ID, ALLOWED_GROUP_IDS, ALLOWED_CHANNEL_IDS, FOREIGN_CHAT_IDS
+
+# Доли типов событий в потоке по умолчанию.
+DEFAULT_MIX = {
+    "message": 0.55,
+    "edited_message": 0.15,
+    "channel_post": 0.05,
+    "edited_channel_post": 0.02,
+    "foreign_message": 0.15,
+    "chat_member": 0.075,
+    "editor_exit": 0.005,
+}
+
+_ADMIN_RIGHTS = {
+    "can_be_edited": False, "is_anonymous": False, "can_manage_chat": True, "can_delete_messages": True,
+    "can_manage_video_chats": True, "can_restrict_members": True, "can_promote_members": False,
+    "can_change_info": True, "can_invite_users": True, "can_post_stories": False, "can_edit_stories": False,
+    "can_delete_stories": False, "can_post_messages": False, "can_edit_messages": False,
+    "can_pin_messages": True, "can_manage_topics": False,
+}
+
+
+class UpdateStream:
+    """Детерминированный (по seed) генератор сырых апдейтов."""
+
+    def __init__(self, seed=0, mix=None, users=500, text_length=(10, 600)):
+        self._rnd = random.Random(seed)
+        self._mix = list((mix or DEFAULT_MIX).items())
+        self._users = users
+        self._text_length = text_length
+        self._update_id = 100000000
+        self._message_ids = {}  # chat_id -> последний message_id
+        self._now = int(time.time())
+
+    def generate(self, count):
+        kinds = [kind for kind, _ in self._mix]
+        weights = [weight for _, weight in self._mix]
+        return [self._make(self._rnd.choices(kinds, weights)[0]) for _ in range(count)]
+
+    def _make(self, kind):
+        self._update_id += 1
+        self._now += self._rnd.randint(0, 2)
+        update = {"update_id": self._update_id}
+        if kind == "message":
+            update["message"] = self._message(self._rnd.choice(ALLOWED_GROUP_IDS), "supergroup")
+        elif kind == "foreign_message":
+            update["message"] = self._message(self._rnd.choice(FOREIGN_CHAT_IDS), "supergroup")
+        elif kind == "edited_message":
+            update["edited_message"] = self._edit(self._rnd.choice(ALLOWED_GROUP_IDS), "supergroup")
+        elif kind == "channel_post":
+            update["channel_post"] = self._message(self._rnd.choice(ALLOWED_CHANNEL_IDS), "channel")
+        elif kind == "edited_channel_post":
+            update["edited_channel_post"] = self._edit(self._rnd.choice(ALLOWED_CHANNEL_IDS), "channel")
+        elif kind == "chat_member":
+            joined = self._rnd.random() < 0.5
+            update["chat_member"] = self._member_change(
+                self._rnd.choice(ALLOWED_GROUP_IDS), self._user(),
+                old_status="left" if joined else "member",
+                new_status="member" if joined else "left",
+            )
+        elif kind == "editor_exit":
+            update["chat_member"] = self._member_change(
+                EDITORS_CHAT_ID, self._user(), old_status="administrator", new_status="left",
+            )
+        else:
+            raise ValueError(f"Неизвестный тип события: {kind}")
+        return update
+
+    def _chat(self, chat_id, chat_type):
+        return {"id": chat_id, "type": chat_type, "title": f"Chat {chat_id}"}
+
+    def _user(self):
+        user_id = self._rnd.randint(1, self._users) + 10000
+        return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}", "username": f"user{user_id}"}
+
+    def _text(self):
+        length = self._rnd.randint(*self._text_length)
+        return "".join(self._rnd.choice("абвгдеёжзийклмнопрстуфхцчшщэюя abcdefgh ") for _ in range(length))
+
+    def _message(self, chat_id, chat_type, message_id=None, date=None):
+        if message_id is None:
+            message_id = self._message_ids.get(chat_id, 0) + 1
+            self._message_ids[chat_id] = message_id
+        message = {
+            "message_id": message_id,
+            "chat": self._chat(chat_id, chat_type),
+            "date": date or self._now,
+            "text": self._text(),
+        }
+        if chat_type == "channel":
+            message["sender_chat"] = self._chat(chat_id, chat_type)
+        else:
+            message["from"] = self._user()
+        return message
+
+    def _edit(self, chat_id, chat_type):
+        """Правка одного из недавних сообщений чата (или нового, если в чате ещё ничего не было)."""
+        last_id = self._message_ids.get(chat_id)
+        if last_id:
+            message_id = self._rnd.randint(max(1, last_id - 50), last_id)
+            message = self._message(chat_id, chat_type, message_id=message_id, date=self._now - self._rnd.randint(1, 3600))
+        else:
+            message = self._message(chat_id, chat_type)
+        message["edit_date"] = self._now
+        return message
+
+    def _member_change(self, chat_id, user, old_status, new_status):
+        def member(status):
+            data = {"user": user, "status": status}
+            if status == "administrator":
+                data.update(_ADMIN_RIGHTS)
+            return data
+
+        return {
+            "chat": self._chat(chat_id, "supergroup"),
+            "from": user,
+            "date": self._now,
+            "old_chat_member": member(old_status),
+            "new_chat_member": member(new_status),
+        }
@@ -0,0 +1,8 @@
+# gunicorn.conf.py
+# Gunicorn подхватывает этот файл автоматически при запуске из корня проекта (см. Procfile).
+
+
+def worker_exit(server, worker):
+    """При штатной остановке воркера дорабатываем очередь апдейтов и дописываем буферы в БД."""
+    from app import bot
+    bot.shutdown()
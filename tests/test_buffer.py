@@ -0,0 +1,57 @@
+# tests/test_buffer.py
+import threading
+
+from app.database.buffer import WriteBehindBuffer
+
+
+def _recording_buffer(max_rows, max_latency):
+    flushed = []
+    cond = threading.Condition()
+
+    def flush_rows(rows):
+        with cond:
+            flushed.append(list(rows))
+            cond.notify_all()
+        return True
+
+    def wait_flushes(count, timeout=2):
+        with cond:
+            return cond.wait_for(lambda: len(flushed) >= count, timeout)
+
+    return WriteBehindBuffer("test", flush_rows, max_rows=max_rows, max_latency=max_latency), flushed, wait_flushes
+
+
+def test_single_row_is_flushed_after_max_latency():
+    # Порог в 200 строк не набирается: каждая строка должна уйти по дедлайну, а не ждать порога или остановки.
+    # Вторая строка приходит, когда фоновый поток уже спит без дедлайна в пустом буфере.
+    buf, flushed, wait_flushes = _recording_buffer(max_rows=200, max_latency=0.05)
+    try:
+        buf.add(("first",))
+        assert wait_flushes(1)
+        buf.add(("second",))
+        assert wait_flushes(2)
+        assert flushed == [[("first",)], [("second",)]]
+    finally:
+        buf.stop()
+
+
+def test_rows_are_flushed_at_max_rows():
+    buf, flushed, wait_flushes = _recording_buffer(max_rows=3, max_latency=60)
+    try:
+        for i in range(3):
+            buf.add((i,))
+        assert wait_flushes(1)
+        assert flushed == [[(0,), (1,), (2,)]]
+    finally:
+        buf.stop()
+
+
+
+def test_failed_flush_goes_to_on_failure():
+    failed = []
+    buf = WriteBehindBuffer("test", lambda rows: False, max_rows=10, max_latency=60, on_failure=failed.append)
+    buf.add((1,))
+    assert buf.flush() is False
+    assert failed == [[(1,)]]
+    assert buf.stats()["rows_failed"] == 1
+    buf.stop()
@@ -0,0 +1,39 @@
+# tests/test_scheduler.py
+import threading
+import time
+
+from app.scheduler import PeriodicScheduler
+
+
+def test_thread_left_running_by_stop_does_not_resume_after_restart():
+    scheduler = PeriodicScheduler()
+    release = threading.Event()
+    running, calls = [], []
+    lock = threading.Lock()
+
+    def long_job():
+        with lock:
+            running.append(threading.current_thread())
+            calls.append(threading.current_thread())
+        release.wait(5)
+        with lock:
+            running.remove(threading.current_thread())
+
+    scheduler.add_job("archive", interval=0.01, func=long_job)
+    scheduler.start()
+    while not calls:
+        time.sleep(0.01)
+    # Потеря и возврат ведущей роли посреди долгой задачи: старый поток ещё внутри long_job.
+    scheduler.stop(timeout=0.05)
+    scheduler.start()
+    time.sleep(0.1)
+    release.set()
+    time.sleep(0.2)
+    scheduler.stop()
+
+    threads = set(calls)
+    assert len(threads) == 2
+    old_thread = calls[0]
+    # Старый поток выполнил задачу один раз и завершился, а не продолжил цикл рядом с новым.
+    assert calls.count(old_thread) == 1
+    assert not old_thread.is_alive()
@@ -0,0 +1,133 @@
+# tests/test_spool.py
+import os
+
+import pytest
+
+from app.database import queries
+from app.database.spool import Spool, read_records
+
+
+def _spool(tmp_path):
+    return Spool(str(tmp_path), fsync_every=1, fsync_interval=0)
+
+
+def _files(tmp_path):
+    return sorted(os.listdir(tmp_path))
+
+
+def _only_file(tmp_path):
+    (name,) = _files(tmp_path)
+    return os.path.join(tmp_path, name)
+
+
+def test_read_records_skips_torn_tail(tmp_path):
+    spool = _spool(tmp_path)
+    for i in range(3):
+        spool.append("message_log", [[i]])
+    spool.sync()
+    path = _only_file(tmp_path)
+    # Процесс упал посреди записи последней пачки.
+    os.truncate(path, os.path.getsize(path) - 3)
+
+    assert [(kind, rows) for kind, rows, _ in read_records(path)] == [("message_log", [[0]]), ("message_log", [[1]])]
+
+
+def test_replay_keeps_unwritten_tail_after_failure(tmp_path):
+    spool = _spool(tmp_path)
+    for i in range(5):
+        spool.append("message_log", [[i]])
+    spool.sync()
+    written, calls = [], []
+
+    def fail_on_second_batch(kind, rows):
+        calls.append(rows)
+        if len(calls) == 2:
+            return False
+        written.extend(rows)
+        return True
+
+    # Пачки по 2 строки: первая записана, на второй БД «пропала».
+    assert spool.replay(fail_on_second_batch, batch_rows=2) == 2
+    assert written == [[0], [1]]
+    # В файле остались только незаписанные записи — при повторе первая пачка не пишется заново.
+    remaining = _only_file(tmp_path)
+    assert [rows for _, rows, _ in read_records(remaining)] == [[[2]], [[3]], [[4]]]
+
+    def write_all(kind, rows):
+        written.extend(rows)
+        return True
+
+    assert spool.replay(write_all, batch_rows=2) == 3
+    assert written == [[0], [1], [2], [3], [4]]
+    assert _files(tmp_path) == []
+    assert spool.stats()["replayed_rows"] == 5
+
+
+def test_replay_of_torn_file_writes_complete_records(tmp_path):
+    spool = _spool(tmp_path)
+    spool.append("message_edits", [[1], [2]])
+    spool.append("message_edits", [[3]])
+    spool.sync()
+    path = _only_file(tmp_path)
+    os.truncate(path, os.path.getsize(path) - 1)
+    written = []
+
+    assert spool.replay(lambda kind, rows: written.extend(rows) or True, batch_rows=100) == 2
+    assert written == [[1], [2]]
+    assert _files(tmp_path) == []
+
+
+def test_corrupt_record_is_set_aside(tmp_path):
+    spool = _spool(tmp_path)
+    spool.append("message_log", [[1]])
+    spool.sync()
+    path = _only_file(tmp_path)
+    with open(path, 'r+b') as f:
+        f.seek(4)
+        f.write(b'!')
+
+    assert spool.replay(lambda kind, rows: True, batch_rows=100) == 0
+    (name,) = _files(tmp_path)
+    assert name.endswith(".corrupt")
+
+
+@pytest.fixture
+def rejecting_db(tmp_path, monkeypatch):
+    """_write_rows, которая отвергает пачки со строкой 'bad', и spool во временном каталоге."""
+    spool = _spool(tmp_path)
+    written = []
+
+    def write_rows(rows_by_kind, state=None):
+        rows = [row for batch in rows_by_kind.values() for row in batch]
+        if any(row[0] == "bad" for row in rows):
+            raise ValueError("A string literal cannot contain NUL (0x00) characters.")
+        written.extend(rows)
+        return True
+
+    monkeypatch.setattr(queries, "_write_rows", write_rows)
+    monkeypatch.setattr(queries, "_spool", spool)
+    return spool, written
+
+
+def test_rejected_rows_are_quarantined_and_the_rest_written(tmp_path, rejecting_db):
+    spool, written = rejecting_db
+    rows = [("ok", i) for i in range(7)]
+    rows[2] = ("bad", 2)
+    rows[5] = ("bad", 5)
+
+    assert queries._write_kind("message_log", rows) is True
+    assert written == [row for row in rows if row[0] == "ok"]
+    assert spool.stats()["quarantined_rows"] == 2
+    quarantine = _only_file(tmp_path)
+    assert os.path.basename(quarantine).startswith("quarantine-")
+    assert [rows for _, rows, _ in read_records(quarantine)] == [[["bad", 2]], [["bad", 5]]]
+    # Карантин не воспроизводится.
+    assert not spool.has_pending()
+
+
+def test_connectivity_failure_is_not_quarantined(monkeypatch, rejecting_db):
+    spool, _ = rejecting_db
+    monkeypatch.setattr(queries, "_write_rows", lambda rows_by_kind, state=None: False)
+
+    assert queries._write_kind("message_log", [("ok", 1)]) is False
+    assert spool.stats()["quarantined_rows"] == 0